@@ -0,0 +1,51 @@
+"""Times the mykhata_analytics functions on a large synthetic ledger.
+
+    python benchmarks/bench_analytics.py [--rows 1000000] [--repeat 5] > analytics.json
+
+Each function runs on a raw ledger frame (the worst case: the pages normally hand it a
+much smaller rollup frame) and the best of --repeat runs is reported in milliseconds.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mykhata_analytics  # noqa: E402
+from synthetic import synthetic_ledger  # noqa: E402
+
+
+def best_of(repeat, func, *args, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(min(timings), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized ledger analytics.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ledger = synthetic_ledger(args.rows)
+    results = {"rows": args.rows, "timings_ms": {}}
+    timings = results["timings_ms"]
+    for granularity in mykhata_analytics.GRANULARITIES:
+        timings[f"bucket_periods[{granularity}]"] = best_of(args.repeat, mykhata_analytics.bucket_periods, ledger['Date'], granularity)
+        timings[f"net_flow[{granularity}]"] = best_of(args.repeat, mykhata_analytics.net_flow, ledger, granularity)
+    timings["period_totals[Monthly, Type]"] = best_of(args.repeat, mykhata_analytics.period_totals, ledger, "Monthly", by="Type")
+    timings["period_totals[Monthly, Category]"] = best_of(args.repeat, mykhata_analytics.period_totals, ledger, "Monthly",
+                                                          by="Category", types=["Expense"])
+    timings["totals_by_category"] = best_of(args.repeat, mykhata_analytics.totals_by_category, ledger, "Expense")
+    timings["totals_by_type"] = best_of(args.repeat, mykhata_analytics.totals_by_type, ledger)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
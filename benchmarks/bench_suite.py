@@ -0,0 +1,154 @@
+"""Headless benchmark of MyKhata's hot paths on synthetic data; no browser or Streamlit needed.
+
+    python benchmarks/bench_suite.py [--engine csv] [--users 1000] [--rows-per-user 10000] [--output results.json]
+
+Generates a data set (see synthetic.py) in a scratch directory, then times, through the same
+CachedStorage/GroupCommitWriter stack the app uses:
+  load_users, load_transactions      cold (fresh cache) and warm
+  load_transactions_window           cold, the last 90 days the transaction table reads
+  search_transactions_first/repeat   a note search, building the household's index, then reusing it
+  save_transaction, save_category    one committed write each
+  dashboard, wallet, report          the data work each page does before drawing (totals,
+                                     rollups, analytics, the first table page)
+for --sample households. Each operation reports n, mean, p50, p95 and max in milliseconds,
+and the whole run is printed (or written to --output) as JSON for comparing commits.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mykhata_analytics  # noqa: E402
+import mykhata_storage  # noqa: E402
+from synthetic import populate  # noqa: E402
+
+GRANULARITIES = list(mykhata_analytics.GRANULARITIES)
+WINDOW_DAYS = 90 # The app's default LEDGER_WINDOW_DAYS
+
+
+def summarize(timings):
+    timings = np.array(timings)
+    return {"n": len(timings), "mean_ms": round(float(timings.mean()), 3), "p50_ms": round(float(np.percentile(timings, 50)), 3),
+            "p95_ms": round(float(np.percentile(timings, 95)), 3), "max_ms": round(float(timings.max()), 3)}
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+# The data work of each page, as the page functions in mykhata_app.py do it
+
+def window_start():
+    return (datetime.datetime.now() - datetime.timedelta(days=WINDOW_DAYS)).date()
+
+
+def dashboard_data(storage, username):
+    mykhata_analytics.summary_figures(storage.load_totals(username))
+    for granularity in GRANULARITIES:
+        mykhata_analytics.net_flow(storage.load_rollup(username, granularity), granularity)
+    storage.query_transactions(username, start=window_start(), limit=0)
+    storage.query_transactions(username, start=window_start(), offset=0, limit=25)
+
+
+def wallet_data(storage, username):
+    mykhata_analytics.summary_figures(storage.load_totals(username))
+    mykhata_analytics.totals_by_category(storage.load_rollup(username, "Yearly"), "Expense")
+
+
+def report_data(storage, username):
+    for granularity in GRANULARITIES:
+        rollup = storage.load_rollup(username, granularity)
+        mykhata_analytics.period_totals(rollup, granularity, by='Type', types=['Income', 'Expense'])
+        mykhata_analytics.period_totals(rollup, granularity, by='Category', types=['Expense'])
+        mykhata_analytics.period_totals(rollup, granularity, by='Type', types=['Loan', 'EMI'])
+
+
+def run(engine, sample, writes):
+    results = {}
+    storage = mykhata_storage.CachedStorage(mykhata_storage.open_storage(engine))
+    users = storage.load_users()
+    usernames = users.loc[users['Role'] == 'Main', 'Username'].tolist()
+    sample_users = [str(name) for name in np.random.default_rng(1).choice(usernames, min(sample, len(usernames)), replace=False)]
+
+    results["load_users_cold"] = summarize([timed(mykhata_storage.CachedStorage(storage.storage).load_users) for _ in range(3)])
+    results["load_users_warm"] = summarize([timed(storage.load_users) for _ in range(20)])
+    results["load_transactions_cold"] = summarize([timed(mykhata_storage.CachedStorage(storage.storage).load_transactions, username)
+                                                   for username in sample_users])
+    results["load_transactions_window"] = summarize([timed(mykhata_storage.CachedStorage(storage.storage).load_transactions, username,
+                                                           start=window_start()) for username in sample_users])
+    for username in sample_users:
+        storage.load_transactions(username) # Fill the shared cache
+    results["load_transactions_warm"] = summarize([timed(storage.load_transactions, username) for username in sample_users])
+
+    # First visit builds rollups/totals that later visits reuse; time both
+    for name, page in [("dashboard", dashboard_data), ("wallet", wallet_data), ("report", report_data)]:
+        results[f"{name}_first"] = summarize([timed(page, storage, username) for username in sample_users])
+        results[f"{name}_repeat"] = summarize([timed(page, storage, username) for username in sample_users])
+    results["search_transactions_first"] = summarize([timed(storage.search_transactions, username, "rent") for username in sample_users])
+    results["search_transactions_repeat"] = summarize([timed(storage.search_transactions, username, "elec bill", types=["Expense"])
+                                                       for username in sample_users])
+
+    writer = mykhata_storage.GroupCommitWriter(storage)
+    today = datetime.date.today()
+    results["save_transaction"] = summarize([
+        timed(writer.append_transaction, sample_users[i % len(sample_users)], today, "Expense", "Food", 99.5, "bench")
+        for i in range(writes)
+    ])
+    results["save_category"] = summarize([
+        timed(writer.save_category, sample_users[i % len(sample_users)], "Expense", f"Bench category {i}")
+        for i in range(writes)
+    ])
+    results["cache"] = storage.cache_stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MyKhata's storage and page data paths headlessly.")
+    parser.add_argument("--engine", default=os.environ.get("MYKHATA_STORAGE", "csv"), choices=sorted(mykhata_storage.STORAGE_ENGINES))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--subusers-per-user", type=int, default=1)
+    parser.add_argument("--categories-per-user", type=int, default=3)
+    parser.add_argument("--rows-per-user", type=int, default=1000)
+    parser.add_argument("--sample", type=int, default=20, help="households the per-user operations are timed on")
+    parser.add_argument("--writes", type=int, default=50, help="saves timed for each write operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)
+        start = time.perf_counter()
+        populate(mykhata_storage.open_storage(args.engine), args.users, args.rows_per_user,
+                 args.subusers_per_user, args.categories_per_user, args.seed)
+        generate_seconds = time.perf_counter() - start
+        results = run(args.engine, args.sample, args.writes)
+        os.chdir(cwd)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "environment": {"python": platform.python_version(), "pandas": pd.__version__, "platform": platform.platform()},
+        "generate_seconds": round(generate_seconds, 2),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
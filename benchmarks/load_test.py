@@ -0,0 +1,203 @@
+"""Concurrent-session load test of mykhata_app.py with Streamlit's in-process AppTest runner.
+
+    python benchmarks/load_test.py [--levels 1,4,8,16] [--iterations 3] [--output load.json]
+
+Seeds a scratch data directory with synthetic households (see synthetic.py), then for each
+concurrency level starts that many simulated sessions at the same moment:
+
+    login -> dashboard -> (add transaction -> report) x --iterations
+
+AppTest keeps per-run global state, so two of them cannot run on threads of one process;
+each session gets its own worker process instead, sharing the data directory the way several
+app processes would. Per level it reports p50/p95/p99 script-run latency, committed write
+throughput, lost writes (saves the app confirmed that are not in storage afterwards),
+households whose balance totals no longer match their ledger, and peak RSS (the sum over
+session processes, and the largest single one). No browser, server or network is needed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from streamlit.testing.v1 import AppTest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO_DIR, "mykhata_app.py")
+sys.path.insert(0, REPO_DIR)
+
+import mykhata_storage  # noqa: E402
+from synthetic import PASSWORD, populate  # noqa: E402
+
+REPORT_TYPES = ["Income vs. Expense", "Category Spending", "Loan/EMI Trends"]
+
+
+class RssSampler(threading.Thread):
+    """Samples this process's resident set size until stopped and keeps the peak (bytes)."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def current(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError: # Not Linux: fall back to the lifetime peak
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.current())
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return max(self.peak, self.current())
+
+
+class Session:
+    """One simulated user clicking through the app."""
+
+    def __init__(self, username, tag, iterations, timeout):
+        self.username = username
+        self.tag = tag # Notes of this session's transactions start with it
+        self.iterations = iterations
+        self.timeout = timeout
+        self.latencies = []
+        self.confirmed_writes = 0
+        self.errors = []
+        self.started = self.finished = None
+
+    def run_script(self, at):
+        start = time.perf_counter()
+        at.run(timeout=self.timeout)
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    def run(self):
+        self.started = time.time()
+        try:
+            at = AppTest.from_file(APP, default_timeout=self.timeout)
+            self.run_script(at)
+            at.text_input(key="login_username").input(self.username)
+            at.text_input(key="login_password").input(PASSWORD)
+            at.button[0].click()
+            self.run_script(at) # Lands on the dashboard
+            for k in range(self.iterations):
+                at.query_params["nav"] = "Add"
+                self.run_script(at)
+                at.number_input[0].set_value(float(k + 1))
+                at.text_area[0].input(f"{self.tag}-{k}")
+                at.button[0].click()
+                self.run_script(at)
+                if any("Transaction saved" in element.value for element in at.success):
+                    self.confirmed_writes += 1
+                at.query_params["nav"] = "Report"
+                self.run_script(at)
+                at.selectbox(key="report_type_select").select(REPORT_TYPES[k % len(REPORT_TYPES)])
+                self.run_script(at)
+                at.query_params["nav"] = "Home"
+                self.run_script(at)
+        except Exception as e:
+            self.errors.append(repr(e))
+        self.finished = time.time()
+
+
+def run_session(session, work, barrier, results):
+    """Worker process: waits for every session of the level to be ready, then runs one."""
+    os.chdir(work)
+    sampler = RssSampler()
+    sampler.start()
+    barrier.wait()
+    session.run()
+    results.put({"tag": session.tag, "latencies": session.latencies, "confirmed_writes": session.confirmed_writes,
+                 "errors": session.errors, "started": session.started, "finished": session.finished,
+                 "peak_rss": sampler.stop()})
+
+
+def count_stored(storage, sessions):
+    """Transactions in storage whose note carries each session's tag."""
+    stored = {}
+    for username in {session.username for session in sessions}:
+        notes = storage.load_transactions(username, columns=['Note'])['Note'].dropna().astype(str)
+        for session in sessions:
+            if session.username == username:
+                stored[session.tag] = int(notes.str.startswith(session.tag + "-").sum())
+    return stored
+
+
+def run_level(level, usernames, iterations, timeout):
+    sessions = [Session(usernames[i % len(usernames)], f"load{level}s{i}", iterations, timeout) for i in range(level)]
+    context = multiprocessing.get_context("spawn") # Fresh interpreters: nothing of this process's state leaks in
+    barrier, results = context.Barrier(level), context.Queue()
+    workers = [context.Process(target=run_session, args=(session, os.getcwd(), barrier, results)) for session in sessions]
+    for worker in workers:
+        worker.start()
+    finished = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    storage = mykhata_storage.open_storage() # A fresh engine: nothing cached from before the level
+    stored = count_stored(storage, sessions)
+    confirmed = {result["tag"]: result["confirmed_writes"] for result in finished}
+    latencies = np.array([latency for result in finished for latency in result["latencies"]] or [0.0])
+    elapsed = max(result["finished"] for result in finished) - min(result["started"] for result in finished)
+    return {
+        "sessions": level,
+        "script_runs": len(latencies),
+        "latency_ms": {f"p{p}": round(float(np.percentile(latencies, p)), 2) for p in (50, 95, 99)},
+        "elapsed_s": round(elapsed, 2),
+        "confirmed_writes": sum(confirmed.values()),
+        "writes_per_s": round(sum(stored.values()) / elapsed, 2),
+        "lost_writes": sum(max(0, confirmed[tag] - stored[tag]) for tag in confirmed),
+        "totals_mismatched": sum(not storage.verify_totals(username) for username in {session.username for session in sessions}),
+        "peak_rss_mb": round(sum(result["peak_rss"] for result in finished) / 2**20, 1),
+        "peak_rss_per_session_mb": round(max(result["peak_rss"] for result in finished) / 2**20, 1),
+        "errors": [error for result in finished for error in result["errors"]][:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive many simulated MyKhata sessions at once and measure latency, writes and memory.")
+    parser.add_argument("--levels", default="1,4,8,16", help="comma-separated numbers of concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="add-transaction/report rounds per session")
+    parser.add_argument("--users", type=int, default=16, help="synthetic households; sessions share them round-robin")
+    parser.add_argument("--rows-per-user", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds one script run may take")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)
+        usernames = populate(mykhata_storage.open_storage(), args.users, args.rows_per_user)
+        levels = [run_level(int(level), usernames, args.iterations, args.timeout) for level in args.levels.split(",")]
+        os.chdir(cwd)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "storage": os.environ.get("MYKHATA_STORAGE", "csv"),
+        "write_mode": os.environ.get("MYKHATA_WRITE_MODE", "sync"),
+        "levels": levels,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
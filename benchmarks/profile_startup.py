@@ -0,0 +1,110 @@
+"""Cold-start and per-rerun profile of mykhata_app.py.
+
+Runs the app headlessly with Streamlit's AppTest against a scratch data
+directory and prints one JSON document, so CI can track regressions:
+
+    python benchmarks/profile_startup.py [--reruns 5] [--rows 2000] > startup.json
+
+Reported timings are in milliseconds:
+  imports      -- time to import streamlit and pandas in a fresh interpreter
+  first_paint  -- first script run (login page) of a new session
+  login        -- the run that loads the ledger after signing in
+  reruns       -- median rerun time of each page once it is warm
+It also records which optional modules (altair) the login page pulled in.
+Run it in a fresh process each time; imports are only cold once.
+"""
+import time
+
+IMPORT_START = time.perf_counter()
+import streamlit  # noqa: E402
+STREAMLIT_MS = (time.perf_counter() - IMPORT_START) * 1000
+import pandas as pd  # noqa: E402
+IMPORTS_MS = (time.perf_counter() - IMPORT_START) * 1000
+
+import argparse  # noqa: E402
+import hashlib  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import statistics  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO_DIR, "mykhata_app.py")
+sys.path.insert(0, REPO_DIR)
+
+import mykhata_storage  # noqa: E402
+
+PAGES = ["Home", "Wallet", "Add", "Report", "Profile"]
+USERNAME, PASSWORD = "profile_user", "Profile@1"
+
+
+def seed(rows):
+    """Creates one Main user with `rows` transactions spread over two years."""
+    storage = mykhata_storage.open_storage()
+    storage.add_user({"Username": USERNAME, "PasswordHash": hashlib.sha256(PASSWORD.encode()).hexdigest(),
+                      "Name": "Profile", "Mobile": "", "Email": "", "Role": "Main", "ParentUsername": None})
+    dates = pd.date_range("2023-01-01", periods=730, freq="D")
+    types = ["Income", "Expense", "Loan", "EMI"]
+    storage.append_transactions(mykhata_storage.transaction_rows(
+        (USERNAME, dates[i % len(dates)], types[i % len(types)], f"Category {i % 12}", float(i % 500 + 1), f"note {i}")
+        for i in range(rows)
+    ))
+
+
+def timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return (time.perf_counter() - start) * 1000
+
+
+def profile(reruns):
+    at = AppTest.from_file(APP, default_timeout=60)
+    first_paint = timed_run(at)
+    loaded_on_login = sorted(m for m in ("altair",) if m in sys.modules)
+
+    at.text_input(key="login_username").input(USERNAME)
+    at.text_input(key="login_password").input(PASSWORD)
+    at.button[0].click()
+    login = timed_run(at)
+
+    pages = {}
+    for page in PAGES:
+        at.query_params["nav"] = page
+        timed_run(at)  # Warm-up: first visit of the page
+        pages[page] = round(statistics.median(timed_run(at) for _ in range(reruns)), 2)
+    return {
+        "first_paint": round(first_paint, 2),
+        "login": round(login, 2),
+        "reruns": pages,
+        "modules_loaded_on_login": loaded_on_login,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile MyKhata cold start and rerun overhead.")
+    parser.add_argument("--reruns", type=int, default=5, help="reruns per page (median is reported)")
+    parser.add_argument("--rows", type=int, default=2000, help="transactions seeded for the profiled user")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work:
+        os.chdir(work)
+        seed(args.rows)
+        result = profile(args.reruns)
+
+    result.update({
+        "imports": {"streamlit": round(STREAMLIT_MS, 2), "total": round(IMPORTS_MS, 2)},
+        "storage": os.environ.get("MYKHATA_STORAGE", "csv"),
+        "rows": args.rows,
+        "streamlit_version": streamlit.__version__,
+    })
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
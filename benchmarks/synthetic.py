@@ -0,0 +1,130 @@
+"""Synthetic MyKhata data for benchmarks and load tests.
+
+    python benchmarks/synthetic.py --users 1000 --rows-per-user 10000 --dir /tmp/khata [--engine csv]
+
+creates a data directory the app can be pointed at (run it from that directory).
+populate() does the same for an already opened storage engine.
+Every generated account uses the password PASSWORD.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mykhata_storage  # noqa: E402
+
+PASSWORD = "Bench@123"
+TRANSACTION_TYPES = ["Income", "Expense", "Loan", "EMI"]
+TYPE_WEIGHTS = [0.15, 0.7, 0.05, 0.1] # Most entries are expenses
+CATEGORIES = {
+    "Income": ["Salary", "Freelance", "Investment", "Gift", "Other Income"],
+    "Expense": ["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Health", "Education", "Other Expense"],
+    "Loan": ["Personal Loan", "Home Loan", "Car Loan", "Student Loan", "Other Loan"],
+    "EMI": ["Loan Repayment", "Credit Card Bill", "Other EMI"],
+}
+NOTES = ["", "groceries", "rent for the month", "fuel", "electricity bill", "school fees", "dinner out", "medicine"]
+
+
+def main_username(i):
+    return f"User{i:05d}"
+
+
+def synthetic_users(users, subusers_per_user=0):
+    """Main accounts User00000.. and, for each, sub-accounts User00000S1.. linked to it."""
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    rows = []
+    for i in range(users):
+        main = main_username(i)
+        rows.append([main, password_hash, f"Bench {i}", "9000000000", f"{main.lower()}@example.com", "Main", None])
+        for j in range(1, subusers_per_user + 1):
+            rows.append([f"{main}S{j}", password_hash, f"Bench {i}.{j}", "9000000000", f"{main.lower()}.{j}@example.com", "Sub", main])
+    return pd.DataFrame(rows, columns=mykhata_storage.USER_COLUMNS)
+
+
+def synthetic_transactions(username, rows, rng, custom_categories=()):
+    """`rows` stored-format transactions (see mykhata_storage.transaction_rows) over the last five years."""
+    types = rng.choice(TRANSACTION_TYPES, rows, p=TYPE_WEIGHTS)
+    categories = np.empty(rows, dtype=object)
+    for trans_type, names in CATEGORIES.items():
+        names = names + [name for category_type, name in custom_categories if category_type == trans_type]
+        mask = types == trans_type
+        categories[mask] = rng.choice(names, mask.sum())
+    dates = pd.Timestamp.now().normalize() - pd.to_timedelta(rng.integers(0, 5 * 365, rows), unit="D")
+    return pd.DataFrame({
+        "Username": username,
+        "Date": dates.sort_values().strftime('%Y-%m-%d'),
+        "Type": types,
+        "Category": categories,
+        "Amount": rng.integers(100, 5_000_000, rows) / 100,
+        "Note": rng.choice(NOTES, rows),
+    }, columns=mykhata_storage.TRANSACTION_COLUMNS)
+
+
+def synthetic_ledger(rows, seed=0):
+    """A typed in-memory ledger (Date, Type, Category, Amount) for benchmarking analytics without storage."""
+    rng = np.random.default_rng(seed)
+    categories = [f"Category {i}" for i in range(40)]
+    return pd.DataFrame({
+        "Date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 5 * 365, rows), unit="D"),
+        "Type": pd.Categorical.from_codes(rng.integers(0, 4, rows), TRANSACTION_TYPES),
+        "Category": pd.Categorical.from_codes(rng.integers(0, len(categories), rows), categories),
+        "Amount": rng.integers(1, 5_000_000, rows) / 100,
+    })
+
+
+def settle(storage):
+    """Waits for background journal compactions and folds what is left, so reads start from compacted partitions."""
+    if not isinstance(storage, mykhata_storage.CsvStorage):
+        return
+    while storage.compacting:
+        time.sleep(0.05)
+    for username in storage.usernames():
+        if os.path.exists(storage.journal_file(username)):
+            storage.compacting.add(username)
+            storage.compact_journal(username)
+
+
+def populate(storage, users, rows_per_user, subusers_per_user=0, categories_per_user=0, seed=0, batch_rows=200_000):
+    """Fills `storage` with synthetic accounts, custom categories and transactions. Returns the main usernames."""
+    rng = np.random.default_rng(seed)
+    storage.save_users(synthetic_users(users, subusers_per_user))
+    usernames = [main_username(i) for i in range(users)]
+    batch = []
+    for username in usernames:
+        custom = [(rng.choice(TRANSACTION_TYPES), f"Custom {k}") for k in range(categories_per_user)]
+        for category_type, name in custom:
+            storage.save_category(username, category_type, name)
+        batch.append(synthetic_transactions(username, rows_per_user, rng, custom))
+        if sum(len(frame) for frame in batch) >= batch_rows:
+            storage.append_transactions(pd.concat(batch, ignore_index=True))
+            batch = []
+    if batch:
+        storage.append_transactions(pd.concat(batch, ignore_index=True))
+    settle(storage)
+    return usernames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic MyKhata data directory")
+    parser.add_argument("--dir", required=True, help="directory to create the data files in")
+    parser.add_argument("--engine", default=os.environ.get("MYKHATA_STORAGE", "csv"), choices=sorted(mykhata_storage.STORAGE_ENGINES))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--subusers-per-user", type=int, default=1)
+    parser.add_argument("--categories-per-user", type=int, default=3)
+    parser.add_argument("--rows-per-user", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    os.chdir(args.dir)
+    start = time.perf_counter()
+    populate(mykhata_storage.open_storage(args.engine), args.users, args.rows_per_user,
+             args.subusers_per_user, args.categories_per_user, args.seed)
+    print(f"Created {args.users} households x {args.rows_per_user} transactions ({args.engine}) in {args.dir} "
+          f"in {time.perf_counter() - start:.1f}s; password: {PASSWORD}")
@@ -0,0 +1,91 @@
+"""
+Vectorized ledger analytics shared by the app pages, the storage rollups and the benchmarks.
+
+Every function accepts a ledger frame (Date, Type, Category, and Amount or the compact ledger's
+Paise) or a rollup frame from load_rollup() (Period instead of Date, already bucketed) and works
+a column at a time; nothing iterates rows or parses dates one by one. Results are in rupees, as
+the pages show them.
+
+    net_flow(df, granularity)                  -> Period, Flow
+    period_totals(df, granularity, by, types)  -> Period, <by>, Amount
+    report_totals(df, granularity, report)     -> period_totals of one of the REPORTS
+    totals_by_category(df, trans_type)         -> Category, Amount (largest first)
+    totals_by_type(df)                         -> {Type: Amount}
+    summary_figures(totals)                    -> balance / income / expense / net_loans
+
+Granularity is one of "Daily", "Monthly" or "Yearly". See benchmarks/bench_analytics.py for timings.
+"""
+
+import pandas as pd
+
+INFLOW_TYPES = ["Income", "Loan"] # Money coming in; Expense and EMI go out
+TRANSACTION_TYPES = ["Income", "Expense", "Loan", "EMI"]
+GRANULARITIES = {"Daily": "datetime64[D]", "Monthly": "datetime64[M]", "Yearly": "datetime64[Y]"}
+# The Reports page's report types (also rendered offline by mykhata_statements): grouped by, Types included
+REPORTS = {
+    "Income vs. Expense": ("Type", ["Income", "Expense"]),
+    "Category Spending": ("Category", ["Expense"]),
+    "Loan/EMI Trends": ("Type", ["Loan", "EMI"]),
+}
+
+
+def bucket_periods(dates, granularity):
+    """Truncates dates to the first day of their day, month or year, as datetime64."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'")
+    dates = pd.Series(pd.to_datetime(dates))
+    # numpy truncates whole arrays to a coarser unit in one cast
+    buckets = dates.to_numpy(dtype='datetime64[ns]').astype(GRANULARITIES[granularity]).astype('datetime64[ns]')
+    return pd.Series(buckets, index=dates.index, name='Period')
+
+def periods(df, granularity):
+    """Period of every row: the Period column of a rollup frame, or the bucketed Date of a ledger."""
+    return df['Period'] if 'Period' in df.columns else bucket_periods(df['Date'], granularity)
+
+def amounts(df):
+    """Amount in rupees of every row, from an Amount column or the compact ledger's Paise."""
+    return df['Amount'] if 'Amount' in df.columns else (df['Paise'] / 100).rename('Amount')
+
+def signed_amounts(df):
+    """Amounts with inflows (Income, Loan) positive and outflows (Expense, EMI) negative."""
+    rupees = amounts(df)
+    return rupees.where(df['Type'].isin(INFLOW_TYPES), -rupees)
+
+def net_flow(df, granularity):
+    """Net flow (inflows minus outflows) per period."""
+    flow = signed_amounts(df).groupby(periods(df, granularity), observed=True).sum()
+    return flow.rename('Flow').rename_axis('Period').reset_index()
+
+def period_totals(df, granularity, by="Type", types=None):
+    """Total Amount per period and Type (or Category), optionally restricted to some Types."""
+    if types is not None:
+        df = df[df['Type'].isin(types)]
+    grouped = amounts(df).groupby([periods(df, granularity), df[by]], observed=True).sum()
+    return grouped.reset_index()
+
+def report_totals(df, granularity, report):
+    """Total Amount per period for one of the REPORTS."""
+    by, types = REPORTS[report]
+    return period_totals(df, granularity, by=by, types=types)
+
+def totals_by_category(df, trans_type="Expense"):
+    """Total Amount per Category for one transaction Type, largest first."""
+    rows = df[df['Type'] == trans_type]
+    grouped = amounts(rows).groupby(rows['Category'], observed=True).sum()
+    return grouped.sort_values(ascending=False).reset_index()
+
+def totals_by_type(df):
+    """Total Amount per transaction Type, with every Type present."""
+    totals = amounts(df).groupby(df['Type'], observed=True).sum()
+    return {trans_type: float(totals.get(trans_type, 0)) for trans_type in TRANSACTION_TYPES}
+
+def summary_figures(totals):
+    """The summary card figures from per-Type totals."""
+    income, expense = totals.get('Income', 0), totals.get('Expense', 0)
+    loans, emi = totals.get('Loan', 0), totals.get('EMI', 0)
+    return {
+        "balance": income - expense - emi + loans,
+        "income": income,
+        "expense": expense,
+        "net_loans": loans - emi,
+    }
@@ -1,33 +1,35 @@
-# Install necessary libraries if running in an environment like Google Colab
-# If you are running this locally and have these installed, you can comment these lines out.
-import subprocess
-import sys
-
-def install_packages():
-    required_packages = ['streamlit', 'pandas', 'altair']
-    for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
-            print(f"Installing {package}...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-            print(f"{package} installed successfully.")
-
-install_packages()
-
 import streamlit as st
 import pandas as pd
 import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import hashlib # For password hashing
-import altair as alt # For charts
+import time
+
+import mykhata_analytics
+import mykhata_categories
+import mykhata_metrics
+import mykhata_schedules
+import mykhata_storage
 
 # --- App Config ---
 st.set_page_config(page_title="MyKhata Modern", layout="wide")
 
+# "async" returns from Save Transaction before the write is committed; failures are shown on the next rerun
+WRITE_MODE = os.environ.get("MYKHATA_WRITE_MODE", "sync")
+
+# The transaction table reads only this many days of recent ledger; older history is read when it asks for it
+LEDGER_WINDOW_DAYS = int(os.environ.get("MYKHATA_WINDOW_DAYS", "90"))
+
+# Usernames allowed to open the Diagnostics page, comma-separated
+ADMIN_USERS = {name.strip() for name in os.environ.get("MYKHATA_ADMINS", "").split(",") if name.strip()}
+
+# If set, Prometheus metrics are written to this file (refreshed at most every METRICS_EXPORT_SECONDS)
+METRICS_FILE = os.environ.get("MYKHATA_METRICS_FILE")
+METRICS_EXPORT_SECONDS = 15
+
 # --- Custom CSS for Mobile Optimization and Styling ---
-st.markdown("""
+APP_CSS = """
     <style>
     /* Hide Streamlit branding and footer */
     #MainMenu {visibility: hidden;}
@@ -78,55 +80,42 @@ st.markdown("""
         color: #424242;
     }
 
-    /* Bottom Navigation Bar Styling */
-    .bottom-bar {
+    /* Bottom Navigation Bar Styling: the block holding .bottom-bar-marker (see bottom_navbar) */
+    div[data-testid="stVerticalBlock"]:has(> div.element-container .bottom-bar-marker) {
         position: fixed;
         bottom: 0;
         left: 0;
         width: 100%;
-        display: flex;
-        justify-content: space-around;
-        align-items: center;
         background: #e3f2fd; /* Light blue */
-        padding: 8px 0;
+        padding: 8px 8px 4px 8px;
         box-shadow: 0 -4px 12px rgba(0, 0, 0, 0.15);
         z-index: 1000;
         border-top-left-radius: 20px;
         border-top-right-radius: 20px;
+        gap: 0;
     }
-    .nav-item {
-        display: flex;
-        flex-direction: column;
+    div[data-testid="stVerticalBlock"]:has(> div.element-container .bottom-bar-marker) div[data-testid="stHorizontalBlock"] {
+        flex-wrap: nowrap; /* Keep the five items on one row on phones */
         align-items: center;
-        cursor: pointer;
+    }
+    div[data-testid="stVerticalBlock"]:has(> div.element-container .bottom-bar-marker) div[data-testid="column"] {
+        min-width: 0;
+    }
+    div[data-testid="stVerticalBlock"]:has(> div.element-container .bottom-bar-marker) .stButton>button {
+        background: transparent;
         color: #555;
         font-size: 0.8em;
         font-weight: 600;
-        transition: color 0.3s ease;
         padding: 5px; /* Add padding for better touch target */
+        box-shadow: none;
+        transition: color 0.3s ease;
     }
-    .nav-item:hover {
+    div[data-testid="stVerticalBlock"]:has(> div.element-container .bottom-bar-marker) .stButton>button:hover,
+    div[data-testid="stVerticalBlock"]:has(> div.element-container .bottom-bar-marker) .stButton>button[kind="primary"] {
         color: #2196F3;
     }
-    .nav-item .icon {
-        font-size: 24px;
-        margin-bottom: 3px;
-    }
-    .plus-btn {
-        font-size: 32px; /* Larger plus icon */
-        color: white;
-        background: #2196F3; /* Bright blue for add button */
-        border-radius: 50%;
-        width: 60px; /* Larger circle */
-        height: 60px;
-        line-height: 60px;
-        text-align: center;
-        margin-top: -30px; /* Pull up to float */
-        box-shadow: 0 4px 10px rgba(0, 0, 0, 0.2);
-        transition: background 0.3s ease;
-    }
-    .plus-btn:hover {
-        background: #1976D2;
+    .bottom-bar-marker {
+        display: none;
     }
 
     /* Hide hamburger menu (sidebar toggle) */
@@ -183,103 +172,207 @@ st.markdown("""
         background-color: #e3f2fd;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def compact_css(css):
+    """Strips comments and indentation once per process; Streamlit re-sends the sheet on every full rerun."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    return re.sub(r"\s*\n\s*", " ", css).strip()
+
+st.markdown(compact_css(APP_CSS), unsafe_allow_html=True)
 
 
 # --- Session State Setup ---
-for key in ["logged_in", "username", "user_role", "parent_username", "show_signup", "account_created", "active_page", "current_user_data", "transaction_df", "category_df"]:
+for key in ["logged_in", "username", "user_role", "parent_username", "show_signup", "account_created", "active_page", "current_user_data", "pending_writes"]:
     if key not in st.session_state:
         if key == "logged_in": st.session_state[key] = False
         elif key == "show_signup": st.session_state[key] = False
         elif key == "account_created": st.session_state[key] = False
         elif key == "active_page": st.session_state[key] = "Home"
         elif key == "user_role": st.session_state[key] = "Main" # Default role
+        elif key == "pending_writes": st.session_state[key] = []
         else: st.session_state[key] = None
 
-# --- File Paths ---
-DATA_FILE = "mykhata_data.csv"
-USERS_FILE = "users_public_details.csv"
-CATEGORY_FILE = "category_memory.csv"
-
 # --- Utility Functions ---
 
+# Panels decorated with @fragment rerun on their own when one of their widgets changes,
+# instead of re-executing the whole script (st.fragment on newer Streamlit, experimental before that)
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
 def hash_password(password):
     """Hashes a password using SHA256."""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def load_users():
-    """Loads user data from CSV or creates an empty DataFrame."""
-    if os.path.exists(USERS_FILE):
-        return pd.read_csv(USERS_FILE)
-    else:
-        # Added 'ParentUsername' column for sub-users
-        df = pd.DataFrame(columns=["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"])
-        df.to_csv(USERS_FILE, index=False)
-        return df
-
-def save_users(df):
-    """Saves user data to CSV."""
-    df.to_csv(USERS_FILE, index=False)
-
-def load_transactions(effective_username):
-    """Loads transaction data for a specific effective_username or creates an empty DataFrame."""
-    if os.path.exists(DATA_FILE):
-        df = pd.read_csv(DATA_FILE)
-        # Ensure 'Username' column exists and filter by effective_username
-        if 'Username' not in df.columns:
-            df['Username'] = '' # Add it if missing
-        return df[df['Username'] == effective_username].copy()
-    else:
-        df = pd.DataFrame(columns=["Username", "Date", "Type", "Category", "Amount", "Note"])
-        df.to_csv(DATA_FILE, index=False)
-        return df[df['Username'] == effective_username].copy()
-
+@st.cache_resource
+def get_storage():
+    """Process-wide storage backend (see mykhata_storage) behind a shared frame cache, used by every session and rerun.
+    Every storage call is timed into mykhata_metrics.METRICS."""
+    return mykhata_metrics.InstrumentedStorage(mykhata_storage.CachedStorage(mykhata_storage.open_storage()))
+
+@st.cache_resource
+def get_writer():
+    """The single group-commit writer that every session's saves go through."""
+    return mykhata_storage.GroupCommitWriter(get_storage())
+
+@st.cache_resource
+def get_category_registry():
+    """Process-wide registry of every user's category taxonomy, ranked by usage (see mykhata_categories)."""
+    return mykhata_categories.CategoryRegistry(get_storage())
+
+def session_user():
+    """The household the current session works on, for charging metrics."""
+    return st.session_state.get("effective_username")
+
+@mykhata_metrics.instrumented("app", user=session_user) # Not the username typed in: before login that is untrusted form input
+def find_user(username):
+    """Looks up one account by username through the storage's user index. Returns a dict, or None if there is no such user."""
+    return get_storage().find_user(username)
+
+@mykhata_metrics.instrumented("app", user=session_user)
+def add_user(username, password_hash, name, mobile, email, role, parent_username):
+    """Creates one account without rewriting the others. Returns False if the username is already taken."""
+    return get_writer().add_user(dict(zip(mykhata_storage.USER_COLUMNS, [username, password_hash, name, mobile, email, role, parent_username])))
+
+def window_start():
+    """First date of the recent ledger window that the transaction table shows by default."""
+    return (datetime.now() - timedelta(days=LEDGER_WINDOW_DAYS)).date()
+
+def has_transactions(effective_username):
+    """Whether the household has any transactions at all, from its balance totals rather than its ledger."""
+    return bool(get_storage().load_totals(effective_username)) or pending_transactions(effective_username) is not None
+
+@mykhata_metrics.instrumented("app")
 def save_transaction(effective_username, date, trans_type, category, amount, note):
-    """Saves a single transaction to the main data file."""
-    if not os.path.exists(DATA_FILE):
-        df = pd.DataFrame(columns=["Username", "Date", "Type", "Category", "Amount", "Note"])
-        df.to_csv(DATA_FILE, index=False)
-
-    df = pd.read_csv(DATA_FILE)
-    new_transaction = pd.DataFrame([{
-        "Username": effective_username,
-        "Date": date.strftime('%Y-%m-%d'),
-        "Type": trans_type,
-        "Category": category,
-        "Amount": amount,
-        "Note": note
-    }])
-    df = pd.concat([df, new_transaction], ignore_index=True)
-    df.to_csv(DATA_FILE, index=False)
-    st.session_state.transaction_df = load_transactions(effective_username) # Refresh session state data
-
-def load_categories(username):
-    """Loads custom categories for a user or creates an empty DataFrame."""
-    if os.path.exists(CATEGORY_FILE):
-        df = pd.read_csv(CATEGORY_FILE)
-        # Filter categories specific to the user or global (if any)
-        return df[df['Username'] == username].copy()
-    else:
-        df = pd.DataFrame(columns=["Username", "CategoryType", "CategoryName"])
-        df.to_csv(CATEGORY_FILE, index=False)
-        return df[df['Username'] == username].copy()
+    """Saves a single transaction. Costs O(1) regardless of ledger size.
 
+    In async write mode the transaction is only queued. Until the writer commits it, this session's
+    summary cards and transaction table show it from pending_transactions(); check_pending_writes()
+    reports it on a later rerun if the commit fails.
+    """
+    if WRITE_MODE == "async":
+        transaction_id = int(mykhata_storage.new_transaction_ids(1)[0]) # Minted here so the pending row has its final Id
+        rows = mykhata_storage.transaction_rows([(effective_username, date, trans_type, category, amount, note, transaction_id)])
+        future = get_writer().submit_async("append_transaction", effective_username, date, trans_type, category, amount, note, transaction_id)
+        st.session_state.pending_writes.append((future, rows))
+    else:
+        get_writer().append_transaction(effective_username, date, trans_type, category, amount, note)
+
+@mykhata_metrics.instrumented("app")
+def update_transaction(effective_username, transaction_id, date, trans_type, category, amount, note, old_date=None):
+    """Replaces one transaction, found by its Id (and the date it was shown with), without rewriting the ledger.
+    Returns False if it no longer exists."""
+    return get_writer().update_transaction(effective_username, transaction_id, date, trans_type, category, amount, note, old_date) is not None
+
+@mykhata_metrics.instrumented("app")
+def delete_transaction(effective_username, transaction_id, old_date=None):
+    """Deletes one transaction, found by its Id (and the date it was shown with), without rewriting the ledger.
+    Returns False if it no longer exists."""
+    return get_writer().delete_transaction(effective_username, transaction_id, old_date)
+
+def pending_transactions(effective_username):
+    """The household's async saves from this session that the writer hasn't committed yet, as transaction
+    rows, or None if there are none."""
+    rows = [rows for future, rows in st.session_state.pending_writes if not future.done() and rows['Username'].iloc[0] == effective_username]
+    return pd.concat(rows, ignore_index=True) if rows else None
+
+def query_with_pending(effective_username, offset, limit, filters):
+    """One page of query_transactions() with `filters`, with the pending saves that match the filters
+    merged in where the sort order puts them. Returns (page, number of matching rows)."""
+    def fetch(offset, limit):
+        return get_storage().query_transactions(effective_username, offset=offset, limit=limit, **filters)
+
+    pending = pending_transactions(effective_username)
+    if pending is not None:
+        pending, _ = mykhata_storage.query_frame(pending, **filters, offset=0, limit=len(pending))
+    if pending is None or pending.empty:
+        return fetch(offset, limit)
+    # Pending rows can push up to len(pending) stored rows from before the page into it
+    before = min(offset, len(pending))
+    rows, total = fetch(offset - before, limit + before)
+    committed = rows['Id'].isin(pending['Id']) # Committed since pending_transactions() looked
+    rows = rows[~committed]
+    merged = pd.concat([pending, rows], ignore_index=True) if not rows.empty else pending
+    page, _ = mykhata_storage.query_frame(merged, sort_by=filters["sort_by"], descending=filters["descending"], offset=before, limit=limit)
+    return page, total - int(committed.sum()) + len(pending)
+
+def check_pending_writes():
+    """Drops finished async saves and reports any that failed."""
+    pending = st.session_state.pending_writes
+    failed = [future for future, _ in pending if future.done() and future.exception() is not None]
+    st.session_state.pending_writes = [(future, rows) for future, rows in pending if not future.done()]
+    if failed:
+        st.error(f"❌ {len(failed)} transaction(s) could not be saved: {failed[0].exception()}")
+
+@mykhata_metrics.instrumented("app")
 def save_category(username, category_type, category_name):
-    """Saves a custom category for a user."""
-    if not os.path.exists(CATEGORY_FILE):
-        df = pd.DataFrame(columns=["Username", "CategoryType", "CategoryName"])
-        df.to_csv(CATEGORY_FILE, index=False)
-
-    df = pd.read_csv(CATEGORY_FILE)
-    if not ((df['Username'] == username) & (df['CategoryName'] == category_name)).any():
-        new_category = pd.DataFrame([{
-            "Username": username,
-            "CategoryType": category_type,
-            "CategoryName": category_name
-        }])
-        df = pd.concat([df, new_category], ignore_index=True)
-        df.to_csv(CATEGORY_FILE, index=False)
-        st.session_state.category_df = load_categories(username) # Refresh session state data
+    """Saves a custom category for a user. Returns False if the user already has it."""
+    return get_writer().save_category(username, category_type, category_name)
+
+@mykhata_metrics.instrumented("app")
+def post_due_payments(effective_username):
+    """Records the payments of the household's auto-posting schedules that fell due since they were last posted. Returns how many."""
+    return len(get_writer().post_due_schedules(datetime.now().date(), [effective_username]))
+
+@mykhata_metrics.instrumented("app")
+def mark_payment_made(effective_username, schedule_id, due):
+    """Records a schedule's next payment, due on `due`, as a transaction and moves the schedule past it."""
+    get_writer().post_due_schedules(due, [effective_username], [schedule_id])
+
+@mykhata_metrics.instrumented("app")
+def save_schedule(effective_username, trans_type, category, amount, frequency, start_date, payments, auto_post, note):
+    """Adds a recurring payment schedule for the household."""
+    get_writer().save_schedules(mykhata_storage.schedule_rows([(effective_username, trans_type, category, amount, frequency,
+                                                                start_date, payments, auto_post, note)]))
+
+@mykhata_metrics.instrumented("app")
+def delete_schedule(effective_username, schedule_id):
+    """Deletes one of the household's schedules; payments it already recorded stay in the ledger."""
+    return get_writer().delete_schedule(effective_username, schedule_id)
+
+def metrics_gauges():
+    """Current shared-cache and writer figures, exported alongside the call metrics."""
+    cache, writer = get_storage().cache_stats(), get_writer()
+    return {
+        "mykhata_cache_bytes": cache["bytes"],
+        "mykhata_cache_entries": cache["entries"],
+        "mykhata_cache_evictions": cache["evictions"],
+        "mykhata_writer_commits": writer.commits,
+        "mykhata_writer_committed_rows": writer.committed_rows,
+        "mykhata_writer_queue_length": writer.queue.qsize(),
+    }
+
+def export_metrics():
+    """Refreshes METRICS_FILE if it is configured and older than METRICS_EXPORT_SECONDS."""
+    metrics = mykhata_metrics.METRICS
+    if METRICS_FILE and time.time() - getattr(metrics, "exported_at", 0) >= METRICS_EXPORT_SECONDS:
+        metrics.exported_at = time.time()
+        metrics.write_prometheus(METRICS_FILE, metrics_gauges())
+
+def balance_summary(effective_username):
+    """Summary card figures, read from the storage's running totals instead of scanning the ledger,
+    plus this session's saves the writer hasn't committed yet."""
+    totals = dict(get_storage().load_totals(effective_username))
+    pending = pending_transactions(effective_username) # After the totals, so a save committed in between isn't counted twice
+    if pending is not None:
+        for trans_type, amount in mykhata_analytics.totals_by_type(pending).items():
+            totals[trans_type] = totals.get(trans_type, 0) + amount
+    return mykhata_analytics.summary_figures(totals)
+
+def summary_cards(effective_username, balance_title):
+    """Renders the four summary cards shown on the Home and Wallet pages."""
+    summary = balance_summary(effective_username)
+    cards = [(balance_title, summary["balance"]), ("Total Income", summary["income"]),
+             ("Total Expense", summary["expense"]), ("Net Loans", summary["net_loans"])]
+    for row in (cards[:2], cards[2:]):
+        for col, (title, value) in zip(st.columns(2), row):
+            with col:
+                st.markdown(f"""
+                <div class="stCard">
+                    <h3>{title}</h3>
+                    <p>₹ {value:,.2f}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
 # --- Authentication Pages ---
 
@@ -296,20 +389,18 @@ def login_page():
             create_account_button = st.form_submit_button("Create a new account")
 
     if login_button:
-        users = load_users()
-        hashed_password = hash_password(password)
-        match = users[(users["Username"] == username) & (users["PasswordHash"] == hashed_password)]
-        if not match.empty:
+        user = find_user(username)
+        if user is not None and user["PasswordHash"] == hash_password(password):
             st.session_state.logged_in = True
             st.session_state.username = username
-            st.session_state.user_role = match.iloc[0]["Role"]
-            st.session_state.parent_username = match.iloc[0]["ParentUsername"] if pd.notna(match.iloc[0]["ParentUsername"]) else None
+            st.session_state.user_role = user["Role"]
+            st.session_state.parent_username = user["ParentUsername"] if pd.notna(user["ParentUsername"]) else None
             
             # Determine the effective username for data storage
             st.session_state.effective_username = st.session_state.parent_username if st.session_state.user_role == "Sub" else st.session_state.username
             
-            st.session_state.transaction_df = load_transactions(st.session_state.effective_username)
-            st.session_state.category_df = load_categories(st.session_state.username) # Categories are per actual user
+            # Auto-posting schedules catch up at login; main_app() reports it after the rerun
+            st.session_state.posted_payments = post_due_payments(st.session_state.effective_username)
             st.success("✅ Login Successful!")
             st.experimental_rerun()
         else:
@@ -345,15 +436,10 @@ def signup_page():
             st.error("Password must start with an uppercase letter and include at least one special character.")
             return
 
-        users = load_users()
-        if username in users["Username"].values:
+        hashed_password = hash_password(password)
+        if not add_user(username, hashed_password, name, mobile, email, "Main", None):
             st.error("Username already exists. Please choose a different one.")
         else:
-            hashed_password = hash_password(password)
-            new_user = pd.DataFrame([[username, hashed_password, name, mobile, email, "Main", None]],
-                                    columns=["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"])
-            users = pd.concat([users, new_user], ignore_index=True)
-            save_users(users)
             st.success("Account created successfully! Please log in.")
             st.session_state.show_signup = False
             st.session_state.account_created = True # Indicate successful creation for login page
@@ -364,189 +450,213 @@ def signup_page():
         st.experimental_rerun()
 
 # --- Navigation Bar ---
+NAV_ITEMS = [("Home", "🏠 Home"), ("Wallet", "💰 Wallet"), ("Add", "➕"), ("Report", "📊 Report"), ("Profile", "⚙️ Profile")]
+
+def navigate(page):
+    """Switches page inside the current session. Keeps ?nav= in the URL so the page survives a refresh."""
+    st.session_state.active_page = page
+    st.query_params["nav"] = page
+
 def bottom_navbar():
-    # JavaScript to update query params without full page reload
-    js = """
-    <script>
-        function navigate(page) {
-            const urlParams = new URLSearchParams(window.location.search);
-            urlParams.set('nav', page);
-            window.location.search = urlParams.toString();
-        }
-    </script>
-    """
-    st.markdown(js, unsafe_allow_html=True)
-
-    st.markdown(f"""
-    <div class="bottom-bar">
-        <div onclick="navigate('Home')" class="nav-item">
-            <span class="icon">🏠</span> Home
-        </div>
-        <div onclick="navigate('Wallet')" class="nav-item">
-            <span class="icon">💰</span> Wallet
-        </div>
-        <div onclick="navigate('Add')" class="plus-btn">
-            +
-        </div>
-        <div onclick="navigate('Report')" class="nav-item">
-            <span class="icon">📊</span> Report
-        </div>
-        <div onclick="navigate('Profile')" class="nav-item">
-            <span class="icon">⚙️</span> Profile
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    # Plain Streamlit buttons: a click reruns the script in the same session, with no browser reload
+    # and no reload of the data already in session state
+    with st.container():
+        st.markdown('<div class="bottom-bar-marker"></div>', unsafe_allow_html=True)
+        for col, (page, label) in zip(st.columns(len(NAV_ITEMS)), NAV_ITEMS):
+            with col:
+                st.button(label, key=f"nav_{page}", on_click=navigate, args=(page,), use_container_width=True,
+                          type="primary" if st.session_state.active_page == page else "secondary")
 
 # --- Pages ---
 
+@mykhata_metrics.instrumented("page", user=session_user)
 def dashboard():
     st.markdown(f"<h2 style='color: #1976D2;'>👋 Hello, {st.session_state.username}</h2>", unsafe_allow_html=True)
 
     effective_username = st.session_state.effective_username
-    user_transactions = st.session_state.transaction_df
-    
-    if user_transactions.empty:
+    has_history = has_transactions(effective_username)
+
+    if not has_history:
         st.info("No transactions recorded yet. Add some to see your financial summary!")
-        total_balance = 0
-        total_income = 0
-        total_expense = 0
-        net_loans = 0
-    else:
-        # Ensure 'Amount' column is numeric
-        user_transactions['Amount'] = pd.to_numeric(user_transactions['Amount'], errors='coerce').fillna(0)
 
-        total_income = user_transactions[user_transactions['Type'] == 'Income']['Amount'].sum()
-        total_expense = user_transactions[user_transactions['Type'] == 'Expense']['Amount'].sum()
-        total_loans_taken = user_transactions[user_transactions['Type'] == 'Loan']['Amount'].sum()
-        total_emi_paid = user_transactions[user_transactions['Type'] == 'EMI']['Amount'].sum()
-        
-        total_balance = total_income - total_expense - total_emi_paid + total_loans_taken
-        net_loans = total_loans_taken - total_emi_paid
-
-    # Display summary cards
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Total Balance</h3>
-            <p>₹ {total_balance:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
-    with col2:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Total Income</h3>
-            <p>₹ {total_income:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    col3, col4 = st.columns(2)
-    with col3:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Total Expense</h3>
-            <p>₹ {total_expense:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
-    with col4:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Net Loans</h3>
-            <p>₹ {net_loans:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
+    summary_cards(effective_username, "Total Balance")
 
     st.markdown("---")
     st.subheader("Financial Trends")
 
-    if not user_transactions.empty:
-        user_transactions['Date'] = pd.to_datetime(user_transactions['Date'])
-        
-        # Calculate net flow for charting
-        chart_data = user_transactions.copy()
-        chart_data['Flow'] = chart_data.apply(lambda row: row['Amount'] if row['Type'] in ['Income', 'Loan'] else -row['Amount'], axis=1)
-
-        time_filter = st.selectbox("Filter by:", ["Daily", "Monthly", "Yearly"], key="dashboard_filter")
-
-        if time_filter == "Daily":
-            grouped_data = chart_data.groupby(chart_data['Date'].dt.date)['Flow'].sum().reset_index()
-            grouped_data['Date'] = pd.to_datetime(grouped_data['Date'])
-            x_axis_format = '%Y-%m-%d'
-            x_axis_title = 'Date'
-        elif time_filter == "Monthly":
-            grouped_data = chart_data.groupby(chart_data['Date'].dt.to_period('M'))['Flow'].sum().reset_index()
-            grouped_data['Date'] = grouped_data['Date'].dt.to_timestamp()
-            x_axis_format = '%Y-%m'
-            x_axis_title = 'Month'
-        else: # Yearly
-            grouped_data = chart_data.groupby(chart_data['Date'].dt.to_period('Y'))['Flow'].sum().reset_index()
-            grouped_data['Date'] = grouped_data['Date'].dt.to_timestamp()
-            x_axis_format = '%Y'
-            x_axis_title = 'Year'
-
-        chart = alt.Chart(grouped_data).mark_bar().encode(
-            x=alt.X('Date', axis=alt.Axis(format=x_axis_format, title=x_axis_title)),
-            y=alt.Y('Flow', title='Net Flow (Income/Loan - Expense/EMI)'),
-            color=alt.condition(
-                alt.datum.Flow > 0,
-                alt.value('#4CAF50'),  # Green for positive flow
-                alt.value('#F44336')   # Red for negative flow
-            ),
-            tooltip=[alt.Tooltip('Date', format=x_axis_format), 'Flow']
-        ).properties(
-            title=f'Net Financial Flow ({time_filter})'
-        ).interactive()
-        st.altair_chart(chart, use_container_width=True)
+    if has_history:
+        trend_chart(effective_username)
     else:
         st.info("Add transactions to see financial trends.")
 
     st.markdown("---")
     st.subheader("All Transactions")
-    if not user_transactions.empty:
-        # Sort by date descending for latest transactions first
-        st.dataframe(user_transactions.sort_values(by='Date', ascending=False).drop(columns=['Username']), use_container_width=True)
+    if has_history:
+        transactions_table(effective_username)
     else:
         st.info("No transactions to display.")
 
 
+@fragment
+def trend_chart(effective_username):
+    """Net flow chart with its own period filter."""
+    import altair as alt # Loaded on first use so login and other pages start without it
+    time_filter = st.selectbox("Filter by:", ["Daily", "Monthly", "Yearly"], key="dashboard_filter")
+
+    # Net flow per period, read from the storage's precomputed rollups
+    rollup = get_storage().load_rollup(effective_username, time_filter)
+    grouped_data = mykhata_analytics.net_flow(rollup, time_filter).rename(columns={'Period': 'Date'})
+
+    if time_filter == "Daily":
+        x_axis_format = '%Y-%m-%d'
+        x_axis_title = 'Date'
+    elif time_filter == "Monthly":
+        x_axis_format = '%Y-%m'
+        x_axis_title = 'Month'
+    else: # Yearly
+        x_axis_format = '%Y'
+        x_axis_title = 'Year'
+
+    chart = alt.Chart(grouped_data).mark_bar().encode(
+        x=alt.X('Date', axis=alt.Axis(format=x_axis_format, title=x_axis_title)),
+        y=alt.Y('Flow', title='Net Flow (Income/Loan - Expense/EMI)'),
+        color=alt.condition(
+            alt.datum.Flow > 0,
+            alt.value('#4CAF50'),  # Green for positive flow
+            alt.value('#F44336')   # Red for negative flow
+        ),
+        tooltip=[alt.Tooltip('Date', format=x_axis_format), 'Flow']
+    ).properties(
+        title=f'Net Financial Flow ({time_filter})'
+    ).interactive()
+    st.altair_chart(chart, use_container_width=True)
+
+
+@fragment
+def transactions_table(effective_username):
+    """Filterable, searchable transaction table that fetches one page at a time from storage."""
+    search = st.text_input("🔍 Search notes and categories", key="txn_search", placeholder="e.g. plumber, rent").strip()
+    with st.expander("Filter & sort"):
+        col1, col2 = st.columns(2)
+        with col1:
+            date_range = st.date_input("Date range", value=(), key="txn_date_range")
+            types = st.multiselect("Type", ["Income", "Expense", "Loan", "EMI"], key="txn_types")
+            min_amount = st.number_input("Min amount", min_value=0.0, value=0.0, format="%.2f", key="txn_min_amount")
+        with col2:
+            known_categories = sorted(get_storage().load_rollup(effective_username, "Yearly")['Category'].unique())
+            categories = st.multiselect("Category", known_categories, key="txn_categories")
+            sort_by = st.selectbox("Sort by", mykhata_storage.QUERY_SORT_COLUMNS, key="txn_sort_by")
+            max_amount = st.number_input("Max amount (0 = no limit)", min_value=0.0, value=0.0, format="%.2f", key="txn_max_amount")
+        descending = st.toggle("Newest / largest first", value=True, key="txn_descending")
+        all_history = st.toggle(f"Include history older than {LEDGER_WINDOW_DAYS} days", value=False, key="txn_all_history")
+
+    # Without a date range only the recent window is read; older history is loaded when asked for
+    filters = {
+        "start": date_range[0] if len(date_range) > 0 else (None if all_history else window_start()),
+        "end": date_range[1] if len(date_range) > 1 else None,
+        "types": types,
+        "categories": categories,
+        "min_amount": min_amount or None,
+        "max_amount": max_amount or None,
+        "sort_by": sort_by,
+        "descending": descending,
+    }
+
+    # Searches run over the whole history through the full-text index, best match first;
+    # only the date range and type filters apply to them
+    search_filters = {"start": date_range[0] if len(date_range) > 0 else None, "end": filters["end"], "types": types}
+
+    def fetch(offset, limit):
+        if search:
+            return get_storage().search_transactions(effective_username, search, offset=offset, limit=limit, **search_filters)
+        return query_with_pending(effective_username, offset, limit, filters)
+
+    col_size, col_page = st.columns(2)
+    with col_size:
+        page_size = st.selectbox("Rows per page", [25, 50, 100], key="txn_page_size")
+    # Only the row count is needed to size the pager, so ask for an empty page first
+    _, total = fetch(0, 0)
+    page_count = max(1, -(-total // page_size))
+    with col_page:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, step=1, key="txn_page")
+
+    page = min(page, page_count)
+    rows, total = fetch((page - 1) * page_size, page_size)
+    if total == 0 and search:
+        st.info(f"No transactions mention '{search}'.")
+        return
+    if total == 0:
+        st.info("No transactions match these filters." if all_history or date_range else
+                f"No transactions in the last {LEDGER_WINDOW_DAYS} days. Turn on older history under Filter & sort to see the rest.")
+        return
+    window_note = f" matching '{search}', best first" if search else ("" if all_history or date_range else f" from the last {LEDGER_WINDOW_DAYS} days")
+    st.caption(f"Showing {(page - 1) * page_size + 1}–{(page - 1) * page_size + len(rows)} of {total} transactions{window_note}")
+    # Id is only used for editing, Score only for ordering search results
+    st.dataframe(rows, use_container_width=True, hide_index=True, column_config={"Id": None, "Score": None})
+    transaction_editor(effective_username, rows)
+
+def transaction_editor(effective_username, rows):
+    """Edits or deletes one of the transactions on the current table page, by its Id."""
+    with st.expander("✏️ Edit or delete a transaction"):
+        labels = {int(row.Id): f"{row.Date:%d %b %Y} · {row.Type} · {row.Category} · ₹{row.Amount:,.2f}" + (f" · {row.Note}" if pd.notna(row.Note) and row.Note else "")
+                  for row in rows.itertuples(index=False)}
+        transaction_id = st.selectbox("Transaction", list(labels), format_func=labels.get, key="edit_txn_id")
+        row = rows[rows['Id'] == transaction_id].iloc[0]
+        types = ["Expense", "Income", "Loan", "EMI"]
+        category_options = get_category_registry().options(st.session_state.username, effective_username, row['Type'])
+        if row['Category'] not in category_options:
+            category_options = [row['Category']] + category_options
+
+        # Keys carry the Id so the fields are prefilled afresh whenever another transaction is picked
+        with st.form(f"edit_transaction_form_{transaction_id}"):
+            date = st.date_input("Date", row['Date'].date(), key=f"edit_date_{transaction_id}")
+            trans_type = st.selectbox("Type", types, index=types.index(row['Type']), key=f"edit_type_{transaction_id}")
+            category = st.selectbox("Category", category_options, index=category_options.index(row['Category']), key=f"edit_category_{transaction_id}")
+            amount = st.number_input("Amount", min_value=0.01, value=float(row['Amount']), format="%.2f", key=f"edit_amount_{transaction_id}")
+            note = st.text_area("Note (Optional)", "" if pd.isna(row['Note']) else str(row['Note']), max_chars=200, key=f"edit_note_{transaction_id}")
+            confirm_delete = st.checkbox("Yes, delete this transaction", key=f"edit_confirm_delete_{transaction_id}")
+            col_save, col_delete = st.columns(2)
+            with col_save:
+                save_button = st.form_submit_button("💾 Save changes")
+            with col_delete:
+                delete_button = st.form_submit_button("🗑️ Delete")
+
+        if save_button:
+            if update_transaction(effective_username, transaction_id, date, trans_type, category, amount, note, row['Date']):
+                st.experimental_rerun() # Totals, charts and the table all change
+            st.error("This transaction no longer exists; it may have been deleted in another session.")
+        if delete_button:
+            if not confirm_delete:
+                st.warning("Tick the confirmation box to delete this transaction.")
+            elif delete_transaction(effective_username, transaction_id, row['Date']):
+                st.experimental_rerun()
+            else:
+                st.error("This transaction no longer exists; it may have been deleted in another session.")
+
+
+@mykhata_metrics.instrumented("page", user=session_user)
 def add_transaction():
     st.markdown("<h2 style='color: #1976D2;'>➕ Add Transaction</h2>", unsafe_allow_html=True)
 
     effective_username = st.session_state.effective_username
     current_username = st.session_state.username # For category management
 
-    # Load categories for the current user
-    user_categories_df = st.session_state.category_df
-    
-    # Default categories
-    default_income_categories = ["Salary", "Freelance", "Investment", "Gift", "Other Income"]
-    default_expense_categories = ["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Health", "Education", "Other Expense"]
-    default_loan_categories = ["Personal Loan", "Home Loan", "Car Loan", "Student Loan", "Other Loan"]
-    default_emi_categories = ["Loan Repayment", "Credit Card Bill", "Other EMI"]
-
-    # Combine default and user-defined categories
-    all_income_categories = sorted(list(set(default_income_categories + user_categories_df[user_categories_df['CategoryType'] == 'Income']['CategoryName'].tolist())))
-    all_expense_categories = sorted(list(set(default_expense_categories + user_categories_df[user_categories_df['CategoryType'] == 'Expense']['CategoryName'].tolist())))
-    all_loan_categories = sorted(list(set(default_loan_categories + user_categories_df[user_categories_df['CategoryType'] == 'Loan']['CategoryName'].tolist())))
-    all_emi_categories = sorted(list(set(default_emi_categories + user_categories_df[user_categories_df['CategoryType'] == 'EMI']['CategoryName'].tolist())))
+    # Default and custom categories, most used first; precomputed until the categories or the ledger change
+    registry = get_category_registry()
+    category_search = st.text_input("🔍 Find a category", key="category_search", placeholder="Type the first letters of a category")
 
     with st.form("transaction_form", clear_on_submit=True):
         date = st.date_input("Date", datetime.now().date())
         trans_type = st.selectbox("Type", ["Expense", "Income", "Loan", "EMI"], key="trans_type")
 
-        category_options = []
-        if trans_type == "Income":
-            category_options = all_income_categories
-        elif trans_type == "Expense":
-            category_options = all_expense_categories
-        elif trans_type == "Loan":
-            category_options = all_loan_categories
-        elif trans_type == "EMI":
-            category_options = all_emi_categories
-        
+        category_options = registry.search(current_username, effective_username, trans_type, category_search)
+        if not category_options:
+            st.caption(f"No {trans_type} category starts with '{category_search}'; showing all of them.")
+            category_options = registry.options(current_username, effective_username, trans_type)
+
         # Add a "Add New Category" option
-        category_options.append("➕ Add New Category...")
-        
+        category_options = category_options + ["➕ Add New Category..."]
+
         category = st.selectbox("Category", category_options, key="category_select")
 
         new_category_name = ""
@@ -578,137 +688,89 @@ def add_transaction():
                 st.success("✅ Transaction saved successfully!")
                 # No explicit rerun here, form clear_on_submit handles it
 
+@mykhata_metrics.instrumented("page", user=session_user)
 def wallet():
     st.markdown("<h2 style='color: #1976D2;'>💼 Wallet Overview</h2>", unsafe_allow_html=True)
 
     effective_username = st.session_state.effective_username
-    user_transactions = st.session_state.transaction_df
 
-    if user_transactions.empty:
+    if not has_transactions(effective_username):
         st.info("No transactions recorded yet to display wallet overview.")
-        total_balance = 0
-        total_income = 0
-        total_expense = 0
-        net_loans = 0
-    else:
-        user_transactions['Amount'] = pd.to_numeric(user_transactions['Amount'], errors='coerce').fillna(0)
 
-        total_income = user_transactions[user_transactions['Type'] == 'Income']['Amount'].sum()
-        total_expense = user_transactions[user_transactions['Type'] == 'Expense']['Amount'].sum()
-        total_loans_taken = user_transactions[user_transactions['Type'] == 'Loan']['Amount'].sum()
-        total_emi_paid = user_transactions[user_transactions['Type'] == 'EMI']['Amount'].sum()
-        
-        total_balance = total_income - total_expense - total_emi_paid + total_loans_taken
-        net_loans = total_loans_taken - total_emi_paid
-
-    # Display summary cards
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Current Balance</h3>
-            <p>₹ {total_balance:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
-    with col2:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Total Income</h3>
-            <p>₹ {total_income:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    col3, col4 = st.columns(2)
-    with col3:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Total Expense</h3>
-            <p>₹ {total_expense:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
-    with col4:
-        st.markdown(f"""
-        <div class="stCard">
-            <h3>Net Loans</h3>
-            <p>₹ {net_loans:,.2f}</p>
-        </div>
-        """, unsafe_allow_html=True)
+    summary_cards(effective_username, "Current Balance")
 
     st.markdown("---")
     st.subheader("Expense Breakdown by Category")
 
-    if not user_transactions.empty and not user_transactions[user_transactions['Type'] == 'Expense'].empty:
-        expense_by_category = user_transactions[user_transactions['Type'] == 'Expense'].groupby('Category')['Amount'].sum().reset_index()
-        
-        chart = alt.Chart(expense_by_category).mark_arc(outerRadius=120).encode(
-            theta=alt.Theta(field="Amount", type="quantitative"),
-            color=alt.Color(field="Category", type="nominal", title="Category"),
-            order=alt.Order("Amount", sort="descending"),
-            tooltip=["Category", alt.Tooltip("Amount", format=",.2f")]
-        ).properties(
-            title="Expense Distribution"
-        ).interactive()
-        
-        text = alt.Chart(expense_by_category).mark_text(radius=140).encode(
-            theta=alt.Theta(field="Amount", type="quantitative"),
-            text=alt.Text("Amount", format=",.2f"),
-            order=alt.Order("Amount", sort="descending"),
-            color=alt.value("black") # Set the color of the labels to black
-        )
-        
-        st.altair_chart(chart + text, use_container_width=True)
+    # All-time totals per category come from the yearly rollup rather than the ledger
+    expense_by_category = mykhata_analytics.totals_by_category(get_storage().load_rollup(effective_username, "Yearly"), "Expense")
+    if not expense_by_category.empty:
+        expense_breakdown(expense_by_category)
     else:
         st.info("No expense transactions to display a breakdown.")
 
 
+def expense_breakdown(expense_by_category):
+    """Pie chart of expense totals per category."""
+    import altair as alt
+
+    chart = alt.Chart(expense_by_category).mark_arc(outerRadius=120).encode(
+        theta=alt.Theta(field="Amount", type="quantitative"),
+        color=alt.Color(field="Category", type="nominal", title="Category"),
+        order=alt.Order("Amount", sort="descending"),
+        tooltip=["Category", alt.Tooltip("Amount", format=",.2f")]
+    ).properties(
+        title="Expense Distribution"
+    ).interactive()
+
+    text = alt.Chart(expense_by_category).mark_text(radius=140).encode(
+        theta=alt.Theta(field="Amount", type="quantitative"),
+        text=alt.Text("Amount", format=",.2f"),
+        order=alt.Order("Amount", sort="descending"),
+        color=alt.value("black") # Set the color of the labels to black
+    )
+
+    st.altair_chart(chart + text, use_container_width=True)
+
+
+@mykhata_metrics.instrumented("page", user=session_user)
 def report():
     st.markdown("<h2 style='color: #1976D2;'>📊 Reports</h2>", unsafe_allow_html=True)
 
     effective_username = st.session_state.effective_username
-    user_transactions = st.session_state.transaction_df
 
-    if user_transactions.empty:
+    if not has_transactions(effective_username):
         st.info("No transactions to generate reports.")
         return
 
-    user_transactions['Date'] = pd.to_datetime(user_transactions['Date'])
-    user_transactions['Amount'] = pd.to_numeric(user_transactions['Amount'], errors='coerce').fillna(0)
+    report_panel(effective_username)
+
 
-    report_type = st.selectbox("Select Report Type:", ["Income vs. Expense", "Category Spending", "Loan/EMI Trends"], key="report_type_select")
+@fragment
+def report_panel(effective_username):
+    """Report selectors and the chart they pick; changing either only reruns this panel."""
+    import altair as alt
+    report_type = st.selectbox("Select Report Type:", list(mykhata_analytics.REPORTS), key="report_type_select")
     time_filter = st.selectbox("Filter by:", ["Daily", "Monthly", "Yearly"], key="report_time_filter")
 
-    # Determine grouping period
+    # Totals per period, Type and Category are precomputed by the storage engine
+    rollup = get_storage().load_rollup(effective_username, time_filter)
+
     if time_filter == "Daily":
         period_format = '%Y-%m-%d'
         period_title = 'Date'
-        group_by_period = user_transactions['Date'].dt.date
     elif time_filter == "Monthly":
         period_format = '%Y-%m'
         period_title = 'Month'
-        group_by_period = user_transactions['Date'].dt.to_period('M')
     else: # Yearly
         period_format = '%Y'
         period_title = 'Year'
-        group_by_period = user_transactions['Date'].dt.to_period('Y')
 
     if report_type == "Income vs. Expense":
         st.subheader("Income vs. Expense Over Time")
-        income_data = user_transactions[user_transactions['Type'] == 'Income'].groupby(group_by_period)['Amount'].sum().reset_index()
-        expense_data = user_transactions[user_transactions['Type'] == 'Expense'].groupby(group_by_period)['Amount'].sum().reset_index()
+        combined_data = mykhata_analytics.report_totals(rollup, time_filter, report_type)
 
-        income_data['Type'] = 'Income'
-        expense_data['Type'] = 'Expense'
-
-        # Rename the period column for Altair
-        income_data.rename(columns={income_data.columns[0]: 'Period'}, inplace=True)
-        expense_data.rename(columns={expense_data.columns[0]: 'Period'}, inplace=True)
-
-        combined_data = pd.concat([income_data, expense_data])
-        
         if not combined_data.empty:
-            # Convert Period to timestamp for Altair
-            combined_data['Period'] = combined_data['Period'].astype(str).apply(lambda x: datetime.strptime(x, period_format))
-
             chart = alt.Chart(combined_data).mark_line(point=True).encode(
                 x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
                 y=alt.Y('Amount', title='Amount (₹)'),
@@ -723,17 +785,9 @@ def report():
 
     elif report_type == "Category Spending":
         st.subheader("Spending by Category Over Time")
-        expense_data = user_transactions[user_transactions['Type'] == 'Expense'].copy()
-        
-        if not expense_data.empty:
-            expense_data['Period'] = group_by_period.astype(str) # Convert to string for grouping
-            
-            # Group by Period and Category
-            grouped_expense = expense_data.groupby(['Period', 'Category'])['Amount'].sum().reset_index()
-            
-            # Convert Period back to datetime for Altair
-            grouped_expense['Period'] = grouped_expense['Period'].apply(lambda x: datetime.strptime(x, period_format))
+        grouped_expense = mykhata_analytics.report_totals(rollup, time_filter, report_type)
 
+        if not grouped_expense.empty:
             chart = alt.Chart(grouped_expense).mark_bar().encode(
                 x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
                 y=alt.Y('Amount', title='Total Spending (₹)'),
@@ -748,20 +802,10 @@ def report():
 
     elif report_type == "Loan/EMI Trends":
         st.subheader("Loan and EMI Trends Over Time")
-        loan_data = user_transactions[user_transactions['Type'] == 'Loan'].groupby(group_by_period)['Amount'].sum().reset_index()
-        emi_data = user_transactions[user_transactions['Type'] == 'EMI'].groupby(group_by_period)['Amount'].sum().reset_index()
-
-        loan_data['Type'] = 'Loan Taken'
-        emi_data['Type'] = 'EMI Paid'
-
-        loan_data.rename(columns={loan_data.columns[0]: 'Period'}, inplace=True)
-        emi_data.rename(columns={emi_data.columns[0]: 'Period'}, inplace=True)
-
-        combined_data = pd.concat([loan_data, emi_data])
+        combined_data = mykhata_analytics.report_totals(rollup, time_filter, report_type)
+        combined_data['Type'] = combined_data['Type'].map({'Loan': 'Loan Taken', 'EMI': 'EMI Paid'})
 
         if not combined_data.empty:
-            combined_data['Period'] = combined_data['Period'].astype(str).apply(lambda x: datetime.strptime(x, period_format))
-
             chart = alt.Chart(combined_data).mark_line(point=True).encode(
                 x=alt.X('Period', axis=alt.Axis(format=period_format, title=period_title)),
                 y=alt.Y('Amount', title='Amount (₹)'),
@@ -775,11 +819,11 @@ def report():
             st.info("No loan or EMI data for this period.")
 
 
+@mykhata_metrics.instrumented("page", user=session_user)
 def profile():
     st.markdown("<h2 style='color: #1976D2;'>👤 Profile Settings</h2>", unsafe_allow_html=True)
 
-    users_df = load_users()
-    current_user_row = users_df[users_df['Username'] == st.session_state.username].iloc[0]
+    current_user_row = find_user(st.session_state.username)
 
     st.subheader("Your Profile Information")
     col_img, col_details = st.columns([1, 2])
@@ -822,23 +866,21 @@ def profile():
                     st.error("Sub-User Password must start with an uppercase letter and include at least one special character.")
                     return
 
-                if sub_user_username in users_df["Username"].values:
+                hashed_sub_password = hash_password(sub_user_password)
+                if not add_user(sub_user_username, hashed_sub_password, sub_user_name, sub_user_mobile, sub_user_email, "Sub", st.session_state.username):
                     st.error("Sub-User Username already exists. Please choose a different one.")
                 else:
-                    hashed_sub_password = hash_password(sub_user_password)
-                    new_sub_user = pd.DataFrame([[sub_user_username, hashed_sub_password, sub_user_name, sub_user_mobile, sub_user_email, "Sub", st.session_state.username]],
-                                                columns=["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"])
-                    users_df = pd.concat([users_df, new_sub_user], ignore_index=True)
-                    save_users(users_df)
                     st.success(f"Sub-user '{sub_user_username}' created successfully and linked to your account!")
                     st.experimental_rerun()
     else:
         st.info(f"You are a 'Sub' user linked to '{st.session_state.parent_username}' account. Only the main user can add new sub-users.")
 
+    if st.session_state.username in ADMIN_USERS:
+        st.markdown("---")
+        st.button("🛠️ Open Diagnostics", key="open_diagnostics", on_click=navigate, args=("Diagnostics",))
+
     st.markdown("---")
-    st.subheader("Payment Reminders (Upcoming)")
-    st.info("This section will display upcoming loan or EMI due dates.")
-    st.markdown("<small><i>(Feature placeholder)</i></small>", unsafe_allow_html=True)
+    payment_reminders(st.session_state.effective_username)
 
     st.markdown("---")
     if st.button("Logout", key="logout_button"):
@@ -847,23 +889,110 @@ def profile():
         st.session_state.user_role = ""
         st.session_state.parent_username = None
         st.session_state.effective_username = ""
-        st.session_state.transaction_df = pd.DataFrame() # Clear dataframes
-        st.session_state.category_df = pd.DataFrame()
         st.success("You have been logged out.")
         st.experimental_rerun()
 
+@fragment
+def payment_reminders(effective_username):
+    """Overdue and upcoming Loan/EMI payments of the household's schedules, and the schedules themselves."""
+    st.subheader("Payment Reminders (Upcoming)")
+    schedules = get_storage().load_schedules(effective_username)
+    today = datetime.now().date()
+    # A heap over each schedule's next due date; only payments up to the horizon are generated
+    due = mykhata_schedules.reminders(mykhata_schedules.DueQueue(schedules), today)
+    if due.empty:
+        st.info(f"No loan or EMI payments due in the next {mykhata_schedules.REMINDER_DAYS} days." if len(schedules) else
+                "Add a loan or EMI schedule below to be reminded of its due dates.")
+    else:
+        overdue = due[due['Status'] == "Overdue"]
+        if len(overdue):
+            st.warning(f"⚠️ {len(overdue)} payment(s) overdue, ₹{overdue['Amount'].sum():,.2f} in all.")
+        st.dataframe(due.drop(columns=["Username", "ScheduleId"]), use_container_width=True, hide_index=True,
+                     column_config={"Amount": st.column_config.NumberColumn(format="₹%.2f")})
+        next_due = due.drop_duplicates("ScheduleId") # Earliest unpaid payment of each schedule
+        labels = {int(row.ScheduleId): f"{row.Due:%d %b %Y} · {row.Category} · ₹{row.Amount:,.2f}" for row in next_due.itertuples(index=False)}
+        col_pick, col_paid = st.columns([3, 1])
+        with col_pick:
+            schedule_id = st.selectbox("Next payment", list(labels), format_func=labels.get, key="reminder_schedule")
+        with col_paid:
+            if st.button("✅ Mark paid", key="mark_payment_paid"):
+                mark_payment_made(effective_username, schedule_id, next_due.loc[next_due['ScheduleId'] == schedule_id, 'Due'].iloc[0])
+                st.experimental_rerun() # Totals and the ledger change too
+
+    with st.expander("🔁 Loan & EMI schedules"):
+        if len(schedules):
+            listing = schedules.assign(Payments=schedules['Payments'].mask(schedules['Payments'] == 0).astype("Int64"))
+            st.dataframe(listing[["Type", "Category", "Amount", "Frequency", "StartDate", "Payments", "Paid", "AutoPost", "Note"]],
+                         use_container_width=True, hide_index=True,
+                         column_config={"StartDate": "First due", "Payments": "Payments (blank: open-ended)", "AutoPost": "Auto-post"})
+            labels = {int(row.Id): f"{row.Category} · ₹{row.Amount:,.2f} {row.Frequency.lower()}" for row in schedules.itertuples(index=False)}
+            col_pick, col_delete = st.columns([3, 1])
+            with col_pick:
+                schedule_id = st.selectbox("Schedule", list(labels), format_func=labels.get, key="delete_schedule_id")
+            with col_delete:
+                if st.button("🗑️ Delete schedule", key="delete_schedule"):
+                    delete_schedule(effective_username, schedule_id)
+                    st.experimental_rerun()
+
+        trans_type = st.selectbox("Type", mykhata_schedules.SCHEDULE_TYPES, index=1, key="schedule_type")
+        with st.form("add_schedule_form", clear_on_submit=True):
+            category = st.selectbox("Category", get_category_registry().options(st.session_state.username, effective_username, trans_type),
+                                    key="schedule_category")
+            amount = st.number_input("Amount", min_value=0.01, format="%.2f", key="schedule_amount")
+            frequency = st.selectbox("Repeats", list(mykhata_schedules.FREQUENCIES), index=1, key="schedule_frequency")
+            start_date = st.date_input("First due date", today, key="schedule_start")
+            payments = st.number_input("Number of payments (0 = until deleted)", min_value=0, value=0, step=1, key="schedule_payments")
+            auto_post = st.checkbox("Record each payment automatically when it falls due", key="schedule_auto_post")
+            note = st.text_input("Note (Optional)", max_chars=200, key="schedule_note")
+            if st.form_submit_button("Add schedule"):
+                save_schedule(effective_username, trans_type, category, amount, frequency, start_date, int(payments), auto_post, note)
+                st.experimental_rerun()
+
+def diagnostics():
+    st.markdown("<h2 style='color: #1976D2;'>🛠️ Diagnostics</h2>", unsafe_allow_html=True)
+    if st.session_state.username not in ADMIN_USERS:
+        st.error("Only administrators can view diagnostics.")
+        return
+
+    metrics = mykhata_metrics.METRICS
+    gauges = metrics_gauges()
+    cache = get_storage().cache_stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cache hit rate", f"{cache['hits'] / max(1, cache['hits'] + cache['misses']):.0%}")
+    col2.metric("Cache memory", f"{cache['bytes'] / 2**20:.1f} of {cache['max_bytes'] / 2**20:.0f} MB")
+    col3.metric("Writer commits", f"{gauges['mykhata_writer_commits']:,}", help=f"{gauges['mykhata_writer_committed_rows']:,} rows committed")
+
+    st.subheader("Operations")
+    st.caption("storage: engine calls · app: load/save helpers, including writer queueing · page: whole page functions")
+    st.dataframe(metrics.operations_frame(), use_container_width=True, hide_index=True)
+    st.subheader("Time per User")
+    st.dataframe(metrics.users_frame(), use_container_width=True, hide_index=True)
+    st.subheader("Slowest Calls")
+    st.dataframe(metrics.slowest_frame(), use_container_width=True, hide_index=True)
+
+    col_export, col_reset = st.columns(2)
+    with col_export:
+        st.download_button("Download Prometheus metrics", metrics.prometheus_text(gauges), file_name="mykhata_metrics.prom", mime="text/plain")
+    with col_reset:
+        if st.button("Reset metrics", key="reset_metrics"):
+            metrics.reset()
+            st.experimental_rerun()
+
 # --- Main App Logic ---
 def main_app():
     # Get navigation parameter from URL query string
     nav = st.query_params.get("nav", "Home") # Default to Home if not present
     st.session_state.active_page = nav
 
-    # Ensure data is loaded when app starts or after login
-    if st.session_state.logged_in and (st.session_state.transaction_df is None or st.session_state.category_df is None or st.session_state.transaction_df.empty):
+    # Ensure the household is known when app starts or after login
+    if st.session_state.logged_in and not st.session_state.get("effective_username"):
         st.session_state.effective_username = st.session_state.parent_username if st.session_state.user_role == "Sub" else st.session_state.username
-        st.session_state.transaction_df = load_transactions(st.session_state.effective_username)
-        st.session_state.category_df = load_categories(st.session_state.username)
 
+    if st.session_state.get("posted_payments"):
+        st.toast(f"🔁 Recorded {st.session_state.posted_payments} scheduled payment(s) that fell due.")
+        st.session_state.posted_payments = 0
+
+    check_pending_writes()
 
     if st.session_state.active_page == "Home":
         dashboard()
@@ -875,8 +1004,11 @@ def main_app():
         report()
     elif st.session_state.active_page == "Profile":
         profile()
+    elif st.session_state.active_page == "Diagnostics":
+        diagnostics()
     
     bottom_navbar()
+    export_metrics()
 
 # --- Launch App ---
 if not st.session_state.logged_in:
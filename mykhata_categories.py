@@ -0,0 +1,92 @@
+"""
+Category taxonomy for MyKhata's transaction picker.
+
+CategoryRegistry keeps, for each user, the default categories merged with the user's custom
+ones, split by transaction type and ranked by how often the user's household has used each
+one (most used first). An entry is rebuilt only when the user's categories or the household's
+ledger change, as reported by the storage's version(), so a rerun of the Add Transaction page
+costs a couple of version checks and dict lookups. search() answers prefix type-ahead queries
+with a binary search over the lower-cased names and returns the matches in usage order.
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+
+DEFAULT_CATEGORIES = {
+    "Income": ["Salary", "Freelance", "Investment", "Gift", "Other Income"],
+    "Expense": ["Food", "Transport", "Rent", "Utilities", "Shopping", "Entertainment", "Health", "Education", "Other Expense"],
+    "Loan": ["Personal Loan", "Home Loan", "Car Loan", "Student Loan", "Other Loan"],
+    "EMI": ["Loan Repayment", "Credit Card Bill", "Other EMI"],
+}
+REGISTRY_MAX_ENTRIES = 10_000 # Users whose taxonomy is kept, least recently used dropped first
+
+
+def category_usage(rollup):
+    """{(type, category): number of transactions} from a rollup frame (see mykhata_storage.load_rollup)."""
+    if rollup.empty:
+        return {}
+    counts = rollup.groupby(['Type', 'Category'], observed=True)['Count'].sum()
+    return {(str(trans_type), str(category)): int(count) for (trans_type, category), count in counts.items()}
+
+
+class Taxonomy:
+    """The categories of one transaction type for one user, ranked by usage."""
+
+    def __init__(self, names, usage):
+        self.ranked = sorted(names, key=lambda name: (-usage.get(name, 0), name.lower()))
+        self.rank = {name: i for i, name in enumerate(self.ranked)}
+        self.keys = sorted((name.lower(), name) for name in names) # For prefix search
+
+    def search(self, prefix="", limit=None):
+        """Names starting with `prefix` (case-insensitive), most used first."""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return self.ranked[:limit]
+        matches = []
+        for key, name in self.keys[bisect.bisect_left(self.keys, (prefix,)):]:
+            if not key.startswith(prefix):
+                break
+            matches.append(name)
+        return sorted(matches, key=self.rank.__getitem__)[:limit]
+
+
+class CategoryRegistry:
+    """Thread-safe, process-wide cache of every active user's Taxonomy per transaction type."""
+
+    def __init__(self, storage, max_entries=REGISTRY_MAX_ENTRIES):
+        self.storage = storage
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # (username, household) -> (versions, {type: Taxonomy})
+        self.lock = threading.Lock()
+
+    def taxonomies(self, username, household):
+        """{transaction type: Taxonomy} for `username`, ranked by the usage of `household`'s ledger."""
+        key = (username, household)
+        versions = (self.storage.version("categories", username), self.storage.version("transactions", household))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        custom = self.storage.load_categories(username)
+        usage = category_usage(self.storage.load_rollup(household, "Yearly"))
+        taxonomies = {}
+        for trans_type, defaults in DEFAULT_CATEGORIES.items():
+            names = set(defaults) | set(custom.loc[custom['CategoryType'] == trans_type, 'CategoryName'].astype(str))
+            taxonomies[trans_type] = Taxonomy(names, {name: usage.get((trans_type, name), 0) for name in names})
+        with self.lock:
+            self.entries[key] = (versions, taxonomies)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return taxonomies
+
+    def options(self, username, household, trans_type):
+        """Every category of `trans_type`, most used first."""
+        return self.taxonomies(username, household)[trans_type].ranked
+
+    def search(self, username, household, trans_type, prefix="", limit=None):
+        """Categories of `trans_type` starting with `prefix`, most used first."""
+        return self.taxonomies(username, household)[trans_type].search(prefix, limit)
@@ -0,0 +1,245 @@
+"""
+Hot-path instrumentation for MyKhata.
+
+A process-wide registry (METRICS) records, per instrumented operation, the call count, errors,
+a wall-time histogram, rows returned or written, bytes read and written, and shared-cache hits,
+plus the time spent on behalf of each user. Operations are grouped by kind:
+
+    storage  every data call on the engine (see INSTRUMENTED_PREFIXES), via InstrumentedStorage
+    app      the app's own load_*/save_* helpers, including time queued for the writer (@instrumented)
+    page     every page function of the app (@instrumented)
+
+METRICS.prometheus_text() renders everything in the Prometheus text exposition format and
+write_prometheus() stores it atomically, e.g. for node_exporter's textfile collector.
+
+Bytes are the read()/write() volume of the calling thread (Linux /proc/thread-self/io), so they
+include every file, database and socket the call touched; they are 0 on other platforms.
+"""
+
+import functools
+import heapq
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+INSTRUMENTED_PREFIXES = ("load_", "save_", "add_", "append_", "query_", "find_", "update_", "delete_", "search_", "post_")
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Seconds
+SLOWEST_KEPT = 20 # Slowest individual calls kept for the diagnostics page
+USER_LOOKUPS = ("find_user", "add_user") # Storage calls whose username comes from the login/signup forms; charged to no one
+USERS_KEPT = 10_000 # Users timed separately; time of any further ones is charged to OTHER_USERS
+OTHER_USERS = "(other)"
+
+
+def thread_io():
+    """(bytes read, bytes written) so far by the calling thread, or (0, 0) where unavailable."""
+    try:
+        with open("/proc/thread-self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def row_count(result):
+    """Rows in a call's result: frames count their rows, (page, total) query results their page."""
+    if isinstance(result, tuple) and result and isinstance(result[0], pd.DataFrame):
+        result = result[0]
+    return len(result) if isinstance(result, pd.DataFrame) else 0
+
+
+class OperationStats:
+    def __init__(self):
+        self.calls = self.errors = self.rows = 0
+        self.bytes_read = self.bytes_written = 0
+        self.cache_hits = self.cache_misses = 0
+        self.seconds = self.max_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class Metrics:
+    """Thread-safe registry of operation stats, keyed by (kind, operation)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {} # (kind, name) -> OperationStats
+        self.users = {} # username -> [seconds, calls]
+        self.slowest = [] # min-heap of (seconds, started, kind, name, username)
+        self.active = threading.local() # Stack of operations running on this thread, for cache attribution
+        self.started = time.time()
+
+    @contextmanager
+    def timer(self, kind, name, username=None):
+        """Times the enclosed block as one call of `name`. Yields a dict; set "rows" in it to record a row count."""
+        stack = self.active.__dict__.setdefault("stack", [])
+        stack.append((kind, name))
+        call = {"rows": 0, "error": False}
+        read_before, written_before = thread_io()
+        started, start = time.time(), time.perf_counter()
+        try:
+            yield call
+        except Exception: # Not BaseException: Streamlit's rerun/stop signals are not failures
+            call["error"] = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            read_after, written_after = thread_io()
+            stack.pop()
+            self.record(kind, name, seconds, call["rows"], read_after - read_before, written_after - written_before,
+                        call["error"], username, started)
+
+    def record(self, kind, name, seconds, rows=0, bytes_read=0, bytes_written=0, error=False, username=None, started=None):
+        with self.lock:
+            stats = self.operations.setdefault((kind, name), OperationStats())
+            stats.calls += 1
+            stats.errors += error
+            stats.rows += rows
+            stats.bytes_read += bytes_read
+            stats.bytes_written += bytes_written
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+            if username:
+                if username not in self.users and len(self.users) >= USERS_KEPT:
+                    username = OTHER_USERS
+                user = self.users.setdefault(username, [0.0, 0])
+                user[0] += seconds
+                user[1] += 1
+            entry = (seconds, started or time.time(), kind, name, username or "")
+            if len(self.slowest) < SLOWEST_KEPT:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def cache_event(self, hit):
+        """Counts a shared-cache hit or miss against the innermost operation running on this thread."""
+        stack = getattr(self.active, "stack", None)
+        if not stack:
+            return
+        with self.lock:
+            stats = self.operations.setdefault(stack[-1], OperationStats())
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+    def operations_frame(self):
+        """One row per operation, slowest total time first, for the diagnostics page."""
+        with self.lock:
+            rows = [{"Kind": kind, "Operation": name, "Calls": stats.calls, "Errors": stats.errors,
+                     "Mean ms": stats.seconds / stats.calls * 1000 if stats.calls else 0.0,
+                     "Max ms": stats.max_seconds * 1000, "Total s": stats.seconds, "Rows": stats.rows,
+                     "KB read": stats.bytes_read / 1024, "KB written": stats.bytes_written / 1024,
+                     "Cache hits": stats.cache_hits, "Cache misses": stats.cache_misses}
+                    for (kind, name), stats in self.operations.items()]
+        return pd.DataFrame(rows, columns=["Kind", "Operation", "Calls", "Errors", "Mean ms", "Max ms", "Total s", "Rows",
+                                           "KB read", "KB written", "Cache hits", "Cache misses"]).sort_values("Total s", ascending=False)
+
+    def users_frame(self):
+        """Time spent on behalf of each user, most first."""
+        with self.lock:
+            rows = [{"User": username, "Total s": seconds, "Calls": calls, "Mean ms": seconds / calls * 1000}
+                    for username, (seconds, calls) in self.users.items()]
+        return pd.DataFrame(rows, columns=["User", "Total s", "Calls", "Mean ms"]).sort_values("Total s", ascending=False)
+
+    def slowest_frame(self):
+        """The slowest individual calls recorded."""
+        with self.lock:
+            entries = sorted(self.slowest, reverse=True)
+        return pd.DataFrame([{"ms": seconds * 1000, "When": pd.Timestamp(started, unit="s"), "Kind": kind, "Operation": name, "User": username}
+                             for seconds, started, kind, name, username in entries], columns=["ms", "When", "Kind", "Operation", "User"])
+
+    def prometheus_text(self, gauges=None):
+        """All metrics in the Prometheus text format. `gauges` maps extra metric names to current values."""
+        def labels(kind, name, **extra):
+            pairs = [("kind", kind), ("op", name)] + list(extra.items())
+            return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+        with self.lock:
+            operations = sorted(self.operations.items())
+            users = sorted(self.users.items())
+        lines = ["# HELP mykhata_call_seconds Wall time of instrumented storage calls and page renders.",
+                 "# TYPE mykhata_call_seconds histogram"]
+        for (kind, name), stats in operations:
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                lines.append(f"mykhata_call_seconds_bucket{labels(kind, name, le=str(bound))} {count}")
+            lines.append(f"mykhata_call_seconds_bucket{labels(kind, name, le='+Inf')} {stats.calls}")
+            lines.append(f"mykhata_call_seconds_sum{labels(kind, name)} {stats.seconds:.6f}")
+            lines.append(f"mykhata_call_seconds_count{labels(kind, name)} {stats.calls}")
+        for metric, attribute, help_text in [
+            ("mykhata_call_errors_total", "errors", "Instrumented calls that raised."),
+            ("mykhata_rows_total", "rows", "Rows returned or written by instrumented calls."),
+            ("mykhata_bytes_read_total", "bytes_read", "Bytes read by the calling thread during instrumented calls."),
+            ("mykhata_bytes_written_total", "bytes_written", "Bytes written by the calling thread during instrumented calls."),
+            ("mykhata_cache_hits_total", "cache_hits", "Shared frame cache hits during instrumented calls."),
+            ("mykhata_cache_misses_total", "cache_misses", "Shared frame cache misses during instrumented calls."),
+        ]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{labels(kind, name)} {getattr(stats, attribute)}" for (kind, name), stats in operations]
+        lines += ["# HELP mykhata_user_seconds_total Time spent in instrumented calls on behalf of each user.",
+                  "# TYPE mykhata_user_seconds_total counter"]
+        lines += [f'mykhata_user_seconds_total{{user="{escape(username)}"}} {seconds:.6f}' for username, (seconds, _) in users]
+        for metric, value in sorted((gauges or {}).items()):
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        lines += ["# TYPE mykhata_process_start_time_seconds gauge", f"mykhata_process_start_time_seconds {self.started:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, gauges=None):
+        """Writes prometheus_text() to `path` atomically."""
+        with open(path + ".tmp", "w") as f:
+            f.write(self.prometheus_text(gauges))
+        os.replace(path + ".tmp", path)
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+            self.users.clear()
+            self.slowest.clear()
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics()
+
+
+def instrumented(kind, user=None, metrics=METRICS):
+    """Decorator timing every call of a function. `user` returns the username to charge; by default
+    it is the first argument when that is a string."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            username = user() if user else (args[0] if args and isinstance(args[0], str) else None)
+            with metrics.timer(kind, func.__name__, username) as call:
+                result = func(*args, **kwargs)
+                call["rows"] = row_count(result)
+                return result
+        return wrapper
+    return decorate
+
+
+class InstrumentedStorage:
+    """Wraps a storage object (engine, CachedStorage) so every call named with one of INSTRUMENTED_PREFIXES is timed."""
+
+    def __init__(self, storage, metrics=METRICS):
+        self.storage = storage
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self.storage, name)
+        if not (callable(attribute) and name.startswith(INSTRUMENTED_PREFIXES)):
+            return attribute
+
+        @functools.wraps(attribute)
+        def instrumented(*args, **kwargs):
+            username = args[0] if args and isinstance(args[0], str) and name not in USER_LOOKUPS else None
+            with self.metrics.timer("storage", name, username) as call:
+                result = attribute(*args, **kwargs)
+                # Writes report the rows they were given, reads the rows they returned
+                call["rows"] = row_count(args[0]) if args and isinstance(args[0], pd.DataFrame) else row_count(result)
+                return result
+        return instrumented
@@ -0,0 +1,78 @@
+"""
+Recurring Loan/EMI payment schedules and their due dates.
+
+A schedule repeats one payment (Type, Category, Amount, Note) for a household every Frequency
+from StartDate, for Payments payments (0: until the schedule is deleted). Paid counts the payments
+already recorded, so payment k (from 0) is due on StartDate + k * Frequency and the next one due
+is payment Paid; if that date has passed, it is overdue. Due dates are always computed from
+StartDate, so a monthly schedule starting on the 31st falls on each month's last day without drifting.
+
+DueQueue is a priority queue of every schedule's next due date. Walking it in date order yields
+the payments due up to some date for all households in one pass, touching only the schedules that
+are due and never reading a ledger. reminders() lists them for the app; payments_due() turns those
+of auto-posting schedules into transactions (see post_due_schedules() in mykhata_storage).
+"""
+
+import heapq
+from datetime import timedelta
+
+import pandas as pd
+
+SCHEDULE_TYPES = ["Loan", "EMI"]
+FREQUENCIES = {
+    "Weekly": pd.DateOffset(weeks=1),
+    "Monthly": pd.DateOffset(months=1),
+    "Quarterly": pd.DateOffset(months=3),
+    "Yearly": pd.DateOffset(years=1),
+}
+REMINDER_DAYS = 30 # How far ahead reminders look
+REMINDER_COLUMNS = ["Due", "Status", "Username", "Type", "Category", "Amount", "Note", "ScheduleId", "Payment"]
+
+
+def due_date(schedule, payment):
+    """Due date of payment number `payment` (from 0) of a schedule (a dict with StartDate and Frequency)."""
+    return (pd.Timestamp(schedule["StartDate"]) + FREQUENCIES[schedule["Frequency"]] * payment).date()
+
+def has_payment(schedule, payment):
+    """Whether a schedule has a payment number `payment` (from 0)."""
+    return not schedule["Payments"] or payment < schedule["Payments"]
+
+
+class DueQueue:
+    """Min-heap of (next due date, schedule Id, payment number) over schedules with payments left."""
+
+    def __init__(self, schedules):
+        self.schedules = {int(schedule["Id"]): schedule for schedule in schedules.to_dict("records")}
+        self.heap = [(due_date(schedule, schedule["Paid"]), schedule_id, int(schedule["Paid"]))
+                     for schedule_id, schedule in self.schedules.items() if has_payment(schedule, schedule["Paid"])]
+        heapq.heapify(self.heap)
+
+    def due(self, until):
+        """(due date, schedule, payment number) for every payment due on or before `until`, earliest first.
+        Walks a copy of the heap, so the queue can be walked again."""
+        heap = list(self.heap)
+        while heap and heap[0][0] <= until:
+            due, schedule_id, payment = heap[0]
+            schedule = self.schedules[schedule_id]
+            yield due, schedule, payment
+            if has_payment(schedule, payment + 1):
+                heapq.heapreplace(heap, (due_date(schedule, payment + 1), schedule_id, payment + 1))
+            else:
+                heapq.heappop(heap)
+
+
+def reminders(queue, today, days=REMINDER_DAYS):
+    """Overdue payments and those due within `days` of `today`, earliest first."""
+    rows = [[due, "Overdue" if due < today else ("Due today" if due == today else "Upcoming"), schedule["Username"],
+             schedule["Type"], schedule["Category"], schedule["Amount"], schedule["Note"], schedule["Id"], payment + 1]
+            for due, schedule, payment in queue.due(today + timedelta(days=days))]
+    return pd.DataFrame(rows, columns=REMINDER_COLUMNS)
+
+def payments_due(queue, until):
+    """The transactions recording every payment due on or before `until`, as (username, date, type, category,
+    amount, note) records, and {schedule Id: new Paid count} to move the schedules past them."""
+    records, paid = [], {}
+    for due, schedule, payment in queue.due(until):
+        records.append((schedule["Username"], due, schedule["Type"], schedule["Category"], schedule["Amount"], schedule["Note"]))
+        paid[int(schedule["Id"])] = payment + 1
+    return records, paid
@@ -0,0 +1,190 @@
+"""
+Full-text search over a household's transaction notes and categories.
+
+LedgerSearchIndex is an inverted index from word tokens to ledger rows. It is built once from a
+household's ledger and then kept current on every write (add() for new and edited transactions,
+remove() for edited and deleted ones), so a search never scans the notes. Query words match as
+prefixes ("plumb" finds "plumber"). Rows are ranked by the summed inverse document frequency of
+the query words they contain, newest first among equals, and can be restricted to a date range
+and to some transaction types.
+
+The CSV and Parquet engines keep one index per household next to its rollup cube; SQLite answers
+the same search_transactions() call with its FTS5 extension.
+"""
+
+import bisect
+import re
+
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN = re.compile(r"\w+")
+PREFIX_END = "\U0010ffff" # Sorts after every word that starts with a given prefix
+RESULT_COLUMNS = ["Id", "Date", "Type", "Category", "Amount", "Note", "Score"]
+
+
+def query_tokens(query):
+    """The distinct lower-case words of a search query, in order."""
+    return list(dict.fromkeys(TOKEN_PATTERN.findall(str(query).lower())))
+
+def tokenize(text):
+    """The distinct lower-case words of a note or category; none for a missing value."""
+    return set() if pd.isna(text) else set(TOKEN_PATTERN.findall(str(text).lower()))
+
+
+class Column:
+    """A numpy array that grows in place, with amortized O(1) appends."""
+
+    def __init__(self, values, dtype):
+        self.data = np.asarray(values, dtype=dtype)
+        self.size = len(self.data)
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.empty(max(16, 2 * self.size), dtype=self.data.dtype)
+            grown[:self.size] = self.data
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def values(self):
+        return self.data[:self.size]
+
+
+class LedgerSearchIndex:
+    """Inverted index of one household's ledger. Not thread-safe; the engine serializes access."""
+
+    def __init__(self, ledger):
+        """Builds the index from a ledger with Id, Date, Type, Category, Note and Amount (rupees) or Paise columns."""
+        paise = ledger['Paise'] if 'Paise' in ledger.columns else (pd.to_numeric(ledger['Amount'], errors='coerce').fillna(0) * 100).round()
+        self.ids = Column(ledger['Id'], 'int64')
+        self.days = Column(pd.to_datetime(ledger['Date']).to_numpy().astype('datetime64[D]').astype('int64'), 'int64')
+        self.paise = Column(paise, 'int64')
+        self.types = Column(ledger['Type'].astype(object), object)
+        self.categories = Column(ledger['Category'].astype(object), object)
+        self.notes = Column(ledger['Note'].astype(object), object)
+        self.alive = Column(np.ones(len(ledger), dtype=bool), bool)
+        self.live = len(ledger)
+        # Rows present at build time are found by binary search over their sorted Ids, later ones through a dict
+        self.base_order = np.argsort(self.ids.values(), kind='stable')
+        self.base_ids = self.ids.values()[self.base_order]
+        self.added = {} # Id -> row of transactions added (or re-added by an edit) since the build
+
+        # Postings of the rows present at build time, in CSR form: the rows holding vocabulary[i] are
+        # rows[bounds[i]:bounds[i + 1]], so a prefix, which covers a run of the sorted vocabulary, is one slice.
+        # Each distinct note/category text is tokenized once and its rows expanded with numpy.
+        texts = []
+        for column in ['Note', 'Category']:
+            values = ledger[column].astype('category')
+            codes = values.cat.codes.to_numpy()
+            order = np.argsort(codes, kind='stable') # Rows grouped by text
+            bounds = np.searchsorted(codes[order], np.arange(len(values.cat.categories) + 1))
+            words = pd.Series(values.cat.categories.astype(str)).str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+            pairs = pd.DataFrame({"text": words.index.to_numpy(), "token": words.to_numpy()}).drop_duplicates()
+            texts.append((pairs, order, bounds))
+        token_ids, vocabulary = pd.factorize(pd.concat([pairs['token'] for pairs, _, _ in texts]), sort=True)
+        self.vocabulary = list(vocabulary)
+        pair_tokens, pair_rows, used = [], [], 0
+        for pairs, order, bounds in texts:
+            text_codes = pairs['text'].to_numpy(dtype='int64')
+            counts = bounds[text_codes + 1] - bounds[text_codes]
+            offsets = np.cumsum(counts) - counts
+            pair_rows.append(order[np.repeat(bounds[text_codes] - offsets, counts) + np.arange(counts.sum())])
+            pair_tokens.append(np.repeat(token_ids[used:used + len(pairs)].astype('int64'), counts))
+            used += len(pairs)
+        rows = max(1, len(ledger))
+        keys = np.sort(np.concatenate(pair_tokens) * rows + np.concatenate(pair_rows)) # By token, then row
+        unique = np.ones(len(keys), dtype=bool)
+        unique[1:] = keys[1:] != keys[:-1] # A word in both note and category counts once
+        keys = keys[unique]
+        self.rows = (keys % rows).astype('int32')
+        self.bounds = np.searchsorted(keys // rows, np.arange(len(self.vocabulary) + 1))
+        self.added_postings = {} # token -> rows added since the build
+        self.added_vocabulary = [] # Their tokens, sorted
+
+    def row_of(self, transaction_id):
+        """Row of a live transaction, or None."""
+        if transaction_id in self.added:
+            return self.added[transaction_id]
+        i = np.searchsorted(self.base_ids, transaction_id)
+        if i < len(self.base_ids) and self.base_ids[i] == transaction_id and self.alive.data[self.base_order[i]]:
+            return int(self.base_order[i])
+        return None
+
+    def add(self, transaction_id, date, trans_type, category, amount, note):
+        """Indexes a new transaction, or the new version of an edited one (after remove())."""
+        row = self.ids.size
+        self.ids.append(transaction_id)
+        self.days.append(np.datetime64(pd.Timestamp(date).date(), 'D').astype('int64'))
+        self.paise.append(int(round(float(amount) * 100)))
+        self.types.append(trans_type)
+        self.categories.append(category)
+        self.notes.append(note)
+        self.alive.append(True)
+        self.live += 1
+        self.added[transaction_id] = row
+        for token in tokenize(note) | tokenize(category):
+            if token not in self.added_postings:
+                bisect.insort(self.added_vocabulary, token)
+            self.added_postings.setdefault(token, []).append(row)
+
+    def remove(self, transaction_id):
+        """Drops a transaction from search results (its postings stay, masked out)."""
+        row = self.row_of(transaction_id)
+        if row is not None:
+            self.alive.data[row] = False
+            self.live -= 1
+            self.added.pop(transaction_id, None)
+
+    def matching_rows(self, token):
+        """Rows containing a word that starts with `token`, dead ones and repeats included."""
+        lo = bisect.bisect_left(self.vocabulary, token)
+        hi = bisect.bisect_left(self.vocabulary, token + PREFIX_END)
+        matched = [self.rows[self.bounds[lo]:self.bounds[hi]]]
+        for word in self.added_vocabulary[bisect.bisect_left(self.added_vocabulary, token):]:
+            if not word.startswith(token):
+                break
+            matched.append(np.array(self.added_postings[word], dtype='int32'))
+        return np.concatenate(matched)
+
+    def search(self, query, start=None, end=None, types=None, offset=0, limit=50):
+        """Transactions matching any word of `query`, best first. Returns (page of RESULT_COLUMNS, number of matches)."""
+        alive = self.alive.values()
+        scores = np.zeros(len(alive))
+        for token in query_tokens(query):
+            hit = np.zeros(len(alive), dtype=bool)
+            hit[self.matching_rows(token)] = True
+            hit &= alive
+            matches = np.count_nonzero(hit)
+            if matches:
+                scores[hit] += np.log(1 + self.live / matches) # Rarer words weigh more
+        rows = np.flatnonzero(scores)
+
+        days = self.days.data[rows]
+        mask = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            mask &= days >= np.datetime64(pd.Timestamp(start).date(), 'D').astype('int64')
+        if end is not None:
+            mask &= days <= np.datetime64(pd.Timestamp(end).date(), 'D').astype('int64')
+        if types:
+            mask &= np.isin(self.types.data[rows], list(types))
+        rows, days = rows[mask], days[mask]
+        scores, total = scores[rows].round(3), len(rows)
+
+        # Best score first, then newest: only the rows up to the end of the page are sorted
+        page = np.empty(0, dtype='int64')
+        stop = min(offset + limit, len(rows))
+        if stop > offset:
+            key = np.round(scores * 1000).astype('int64') * (int(days.max() - days.min()) + 1) + (days - days.min())
+            top = np.argpartition(-key, stop - 1)[:stop] if stop < len(rows) else np.arange(len(rows))
+            page = top[np.argsort(-key[top], kind='stable')][offset:]
+        rows = rows[page]
+        return pd.DataFrame({
+            "Id": self.ids.data[rows],
+            "Date": self.days.data[rows].astype('datetime64[D]').astype('datetime64[ns]'),
+            "Type": self.types.data[rows],
+            "Category": self.categories.data[rows],
+            "Amount": self.paise.data[rows] / 100,
+            "Note": self.notes.data[rows],
+            "Score": scores[page],
+        }, columns=RESULT_COLUMNS), total
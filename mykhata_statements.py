@@ -0,0 +1,147 @@
+"""Offline statements: every household's Reports page, rendered to static HTML and CSV files.
+
+    python mykhata_statements.py [--month YYYY-MM] [--output statements] [--format html csv]
+                                 [--workers N] [--engine csv] [username ...]
+
+Each household gets <output>/<username>.html, with a summary and a monthly table for each of the
+Reports page's report types (Income vs. Expense, Category Spending, Loan/EMI Trends), and
+<output>/<username>.csv with the same figures as Report, Month, Group, Amount rows. With --month
+only that month is reported, reading only that part of each ledger.
+
+Households are spread over a pool of worker processes (one per CPU by default). The parent opens
+(and, on a first start, migrates) the data once; each worker then opens its own read-only connection. A worker reads one ledger, totals it with mykhata_analytics and writes the files
+itself, so only a status line per household goes back to the parent, which prints it as soon as
+that household is done. Households are independent, so the run scales with the number of cores.
+"""
+import argparse
+import html
+import multiprocessing
+import os
+import sys
+import time
+from urllib.parse import quote
+
+import pandas as pd
+
+import mykhata_analytics
+import mykhata_storage
+
+GRANULARITY = "Monthly"
+FORMATS = ["html", "csv"]
+CSV_COLUMNS = ["Report", "Month", "Group", "Amount"]
+
+storage = None # The worker process's read-only storage engine, opened by init_worker()
+
+
+def month_range(month):
+    """First and last day of a YYYY-MM month."""
+    start = pd.Period(month, freq="M")
+    return start.start_time.date(), start.end_time.date()
+
+
+def statement_rows(ledger):
+    """Every report's monthly totals of a ledger, as CSV_COLUMNS rows."""
+    frames = []
+    for report, (by, _) in mykhata_analytics.REPORTS.items():
+        totals = mykhata_analytics.report_totals(ledger, GRANULARITY, report)
+        if totals.empty:
+            continue
+        frames.append(pd.DataFrame({"Report": report, "Month": totals['Period'].dt.strftime('%Y-%m'),
+                                    "Group": totals[by].astype(str), "Amount": totals['Amount'].round(2)},
+                                   columns=CSV_COLUMNS).sort_values(['Month', 'Group'])) # The same order on every engine
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=CSV_COLUMNS)
+
+
+def render_html(username, ledger, rows, month=None):
+    """A household's statement page."""
+    figures = mykhata_analytics.summary_figures(mykhata_analytics.totals_by_type(ledger))
+    net_flow = mykhata_analytics.signed_amounts(ledger).sum() # Of the period reported, not the all-time balance
+    title = f"MyKhata statement: {html.escape(username)}" + (f", {html.escape(month)}" if month else "")
+    parts = [f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title>",
+             "<style>body{font-family:sans-serif;margin:2em}h1,h2{color:#1976D2}"
+             "table{border-collapse:collapse}td,th{border:1px solid #ccc;padding:4px 8px;text-align:right}</style>",
+             f"</head><body><h1>{title}</h1>",
+             f"<p>Income ₹{figures['income']:,.2f} · Expense ₹{figures['expense']:,.2f} · "
+             f"Net loans ₹{figures['net_loans']:,.2f} · Net flow ₹{net_flow:,.2f}</p>"]
+    for report in mykhata_analytics.REPORTS:
+        parts.append(f"<h2>{html.escape(report)}</h2>")
+        table = rows[rows['Report'] == report].pivot_table(index='Month', columns='Group', values='Amount', aggfunc='sum', observed=True)
+        if table.empty:
+            parts.append("<p>No data for this period.</p>")
+        else:
+            table.columns.name = None
+            parts.append(table.to_html(float_format="{:,.2f}".format, na_rep=""))
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
+
+def write_file(path, text):
+    """Writes a file through a temporary copy, so a reader never sees half a statement."""
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+# --- Worker processes ---
+
+def init_worker(engine):
+    global storage
+    storage = mykhata_storage.open_storage(engine, read_only=True) # main() has already migrated the data
+
+
+def write_statement(job):
+    """Renders one household's statement into the output directory. Returns (username, transactions, ms, error)."""
+    username, output, formats, month = job
+    started = time.perf_counter()
+    try:
+        start, end = month_range(month) if month else (None, None)
+        ledger = storage.load_transactions(username, columns=['Date', 'Type', 'Category', 'Amount'], start=start, end=end)
+        ledger = ledger.astype({'Amount': 'float64'}) # An empty month loads with no dtype to total
+        rows = statement_rows(ledger)
+        path = os.path.join(output, quote(username, safe=""))
+        if "csv" in formats:
+            write_file(path + ".csv", rows.to_csv(index=False))
+        if "html" in formats:
+            write_file(path + ".html", render_html(username, ledger, rows, month))
+        return username, len(ledger), (time.perf_counter() - started) * 1000, None
+    except Exception as error: # One bad ledger shouldn't stop the night's run
+        return username, 0, (time.perf_counter() - started) * 1000, f"{type(error).__name__}: {error}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write every household's monthly report as static HTML/CSV statements.")
+    parser.add_argument("usernames", nargs="*", help="households to report (default: all)")
+    parser.add_argument("--month", help="report only this month, YYYY-MM (default: every month)")
+    parser.add_argument("--output", default="statements", help="directory to write into (default: %(default)s)")
+    parser.add_argument("--format", nargs="+", default=FORMATS, choices=FORMATS, help="files to write (default: both)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per CPU)")
+    parser.add_argument("--engine", default=os.environ.get("MYKHATA_STORAGE", "csv"), choices=sorted(mykhata_storage.STORAGE_ENGINES))
+    args = parser.parse_args()
+    if args.month:
+        try:
+            month_range(args.month)
+        except ValueError:
+            parser.error(f"--month must be YYYY-MM, not '{args.month}'")
+
+    source = mykhata_storage.open_storage(args.engine) # Migrates the data once, before the workers open it read-only
+    usernames = args.usernames or source.usernames()
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(username, args.output, args.format, args.month) for username in usernames]
+    workers = max(1, min(args.workers, len(jobs)))
+    chunksize = max(1, len(jobs) // (workers * 16)) # Few enough round trips, small enough to keep every worker busy
+
+    started, failed = time.perf_counter(), 0
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(args.engine,)) as pool:
+        for username, count, ms, error in pool.imap_unordered(write_statement, jobs, chunksize):
+            if error:
+                failed += 1
+                print(f"{username}: FAILED {error}", flush=True)
+            else:
+                print(f"{username}: {count} transactions, {ms:.0f} ms", flush=True)
+    print(f"Wrote {len(jobs) - failed} statement(s) to {args.output} in {time.perf_counter() - started:.1f} s "
+          f"with {workers} worker(s)" + (f"; {failed} failed" if failed else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1796 @@
+"""Storage backends for MyKhata.
+
+The app talks to a single storage object through find_user/add_user/load_users,
+load_transactions/append_transaction and load_categories/save_category.
+Three engines are available:
+
+* CsvStorage     - per-household CSV partitions with an append-only journal (default)
+* ParquetStorage - the same layout with typed, columnar Parquet partitions (needs pyarrow)
+* SqliteStorage  - an embedded SQLite database in WAL mode
+
+Pick one with the MYKHATA_STORAGE environment variable ("csv", "parquet" or "sqlite").
+Existing CSV data can be copied into SQLite once with:
+
+    python mykhata_storage.py migrate-sqlite [--db mykhata.db]
+
+Transactions carry a stable random Id. Editing or deleting one appends a replacement or
+tombstone record to the household's journal, which the next compaction folds into the
+partition; SQLite updates the row in place.
+
+search_transactions() finds transactions by the words of their notes and categories, through an
+inverted index kept up to date on every write (mykhata_search for the file engines, FTS5 for SQLite).
+
+Every engine keeps per-household balance totals up to date on each write.
+Check (and optionally repair) them against the raw ledger with:
+
+    python mykhata_storage.py verify-totals [--rebuild]
+
+Recurring Loan/EMI schedules (see mykhata_schedules) post their due payments as transactions
+when their household logs in, or for every household at once, e.g. daily from cron, with:
+
+    python mykhata_storage.py post-due [--date YYYY-MM-DD] [--dry-run]
+"""
+import abc
+import argparse
+import bisect
+import csv
+import io
+import itertools
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import mykhata_analytics
+import mykhata_schedules
+import mykhata_search
+from mykhata_metrics import METRICS
+
+try:
+    import fcntl
+except ImportError: # Windows: only in-process locking
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Only needed for the parquet engine
+    pa = pq = None
+
+# --- File Paths ---
+DATA_FILE = "mykhata_data.csv" # Legacy shared ledger, split into LEDGER_DIR on first start
+JOURNAL_FILE = "mykhata_journal.csv" # Legacy shared journal, split along with DATA_FILE
+LEDGER_DIR = "mykhata_ledger" # One partition per household: <user>.csv (compacted) + <user>.journal.csv
+USERS_FILE = "users_public_details.csv"
+LOCK_FILE = ".mykhata.lock" # flock()ed around every write so several app processes can share the CSV files
+CATEGORY_FILE = "category_memory.csv"
+SCHEDULE_FILE = "payment_schedules.csv" # Append-only: the last record of a schedule Id wins, Op "delete" removes it
+SQLITE_FILE = "mykhata.db"
+
+USER_COLUMNS = ["Username", "PasswordHash", "Name", "Mobile", "Email", "Role", "ParentUsername"]
+TRANSACTION_COLUMNS = ["Id", "Username", "Date", "Type", "Category", "Amount", "Note"]
+JOURNAL_COLUMNS = TRANSACTION_COLUMNS + ["Op"] # Op is empty for new transactions, else JOURNAL_EDIT or JOURNAL_DELETE
+JOURNAL_EDIT, JOURNAL_DELETE = "edit", "delete"
+CATEGORY_COLUMNS = ["Username", "CategoryType", "CategoryName"]
+SCHEDULE_COLUMNS = ["Id", "Username", "Type", "Category", "Amount", "Frequency", "StartDate", "Payments", "Paid", "AutoPost", "Note"]
+SCHEDULE_RECORD_COLUMNS = SCHEDULE_COLUMNS + ["Op"]
+
+COMPACT_EVERY = 500 # Journal records per household before a background compaction is started
+PARTITION_BLOCK_ROWS = 10_000 # Rows per block of a CSV partition's date index; date-range reads skip whole blocks
+LEDGER_READ_ATTEMPTS = 3 # Lock-free reads of a household's ledger files before one under the lock
+GROUP_COMMIT_MAX_BATCH = 1000 # Most queued writes committed together by the group-commit writer
+CACHE_MAX_BYTES = int(os.environ.get("MYKHATA_CACHE_MB", "256")) * 1024 * 1024 # Memory budget of the shared frame cache
+
+if pa is not None:
+    PARQUET_SCHEMA = pa.schema([
+        ("Id", pa.int64()),
+        ("Username", pa.dictionary(pa.int32(), pa.string())),
+        ("Date", pa.timestamp("ms")),
+        ("Type", pa.dictionary(pa.int8(), pa.string())),
+        ("Category", pa.dictionary(pa.int32(), pa.string())),
+        ("Amount", pa.int64()), # Paise
+        ("Note", pa.string()),
+    ])
+
+
+def new_transaction_ids(count):
+    """`count` random, non-negative 63-bit transaction Ids. Any process can mint them without coordinating."""
+    return (np.frombuffer(os.urandom(8 * count), dtype=np.uint64) >> np.uint64(1)).astype('int64')
+
+def transaction_rows(records):
+    """Builds the DataFrame stored for transactions from (username, date, type, category, amount, note[, id]) tuples.
+    Records without an id are new transactions and get a fresh one."""
+    df = pd.DataFrame([{
+        "Id": transaction_id[0] if transaction_id else None,
+        "Username": username,
+        "Date": date.strftime('%Y-%m-%d'),
+        "Type": trans_type,
+        "Category": category,
+        "Amount": amount,
+        "Note": note
+    } for username, date, trans_type, category, amount, note, *transaction_id in records], columns=TRANSACTION_COLUMNS)
+    return with_ids(df)
+
+def with_ids(df):
+    """Returns df with an int64 Id column, minting Ids for rows that have none (new or legacy rows)."""
+    ids = df['Id'] if 'Id' in df.columns else pd.Series(np.nan, index=df.index)
+    if ids.dtype == 'int64':
+        return df
+    missing = ids.isna()
+    ids = ids.astype(object)
+    ids[missing] = new_transaction_ids(int(missing.sum()))
+    return df.assign(Id=ids.astype('int64'))[['Id'] + [column for column in df.columns if column != 'Id']]
+
+def schedule_rows(records):
+    """Builds the DataFrame stored for payment schedules (see mykhata_schedules) from (username, type, category, amount,
+    frequency, start date, payments, auto post, note[, id, paid]) tuples. Records without an id are new schedules."""
+    df = pd.DataFrame([{
+        "Id": rest[0] if rest else None,
+        "Username": username,
+        "Type": trans_type,
+        "Category": category,
+        "Amount": amount,
+        "Frequency": frequency,
+        "StartDate": date_text(start_date),
+        "Payments": payments,
+        "Paid": rest[1] if len(rest) > 1 else 0,
+        "AutoPost": auto_post,
+        "Note": note
+    } for username, trans_type, category, amount, frequency, start_date, payments, auto_post, note, *rest in records], columns=SCHEDULE_COLUMNS)
+    return schedule_frame(with_ids(df))
+
+def schedule_frame(df):
+    """Schedules with their stored types: Id, Payments and Paid as int64, Amount as float64, AutoPost as bool."""
+    return df.astype({"Id": "int64", "Amount": "float64", "Payments": "int64", "Paid": "int64"}).assign(
+        AutoPost=df['AutoPost'].astype(str).isin(["True", "1"]))[SCHEDULE_COLUMNS]
+
+def due_schedules(schedules, usernames=None, schedule_ids=None):
+    """The schedules post_due_schedules() covers: those in `schedule_ids` if given, else the auto-posting ones;
+    only those of `usernames` if given."""
+    mask = schedules['Id'].isin(schedule_ids) if schedule_ids is not None else schedules['AutoPost']
+    if usernames is not None:
+        mask &= schedules['Username'].isin(usernames)
+    return schedules[mask]
+
+def date_text(value):
+    """A date, datetime, Timestamp or date string as stored: 'YYYY-MM-DD'."""
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+def date_window(df, start=None, end=None):
+    """Rows of df dated from start to end, both inclusive and either optional."""
+    if start is None and end is None:
+        return df
+    dates = df['Date'] if pd.api.types.is_datetime64_any_dtype(df['Date']) else pd.to_datetime(df['Date'])
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= dates >= pd.Timestamp(start)
+    if end is not None:
+        mask &= dates <= pd.Timestamp(end)
+    return df[mask].reset_index(drop=True)
+
+def apply_journal_ops(df):
+    """Folds edit and delete records (journal rows with an Op) into a concatenated partition + journals frame:
+    the last record of an Id replaces all earlier ones, and deleted Ids are dropped. Returns df without Op."""
+    if 'Op' not in df.columns:
+        return df
+    ops = df['Op'].notna() & (df['Op'] != "")
+    if not ops.any():
+        return df.drop(columns='Op')
+    revised = df[~df['Id'].isin(df.loc[ops, 'Id']) | ops].drop_duplicates('Id', keep='last')
+    return revised[revised['Op'] != JOURNAL_DELETE].drop(columns='Op').reset_index(drop=True)
+
+def file_stamp(path):
+    """(inode, mtime, size) of a file, or None if it doesn't exist; changes whenever any process rewrites it."""
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (info.st_ino, info.st_mtime_ns, info.st_size)
+
+def append_csv(df, path):
+    """Appends rows to a CSV file (writing the header if it is new) and fsyncs it."""
+    header = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as f:
+        df.to_csv(f, header=header, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def with_ledger_types(df):
+    """Returns df with Date as datetime64 and Amount as float64. Copies only if a column actually needs coercion."""
+    needs_date = 'Date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['Date'])
+    needs_amount = 'Amount' in df.columns and not pd.api.types.is_float_dtype(df['Amount'])
+    if not (needs_date or needs_amount):
+        return df
+    df = df.copy()
+    if needs_date:
+        df['Date'] = pd.to_datetime(df['Date'])
+    if needs_amount:
+        df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce').fillna(0).astype('float64')
+    return df
+
+
+# --- Compact Ledger ---
+# How CachedStorage holds a household's ledger in memory: no Username column (a frame belongs to
+# one household), the transaction Id as int64, Date as datetime64, Type and Category as
+# categoricals, amounts as int64 paise in a Paise column, and Note as a categorical whose
+# dictionary is the string pool that repeated notes share. query_frame() filters and sorts it
+# as-is and converts only the returned page back to rupees. Pages never see it: they read
+# totals, rollups and query pages, which are already small.
+
+LEDGER_COLUMNS = ["Id", "Date", "Type", "Category", "Paise", "Note"]
+LEDGER_TYPE_DTYPE = pd.CategoricalDtype(["Income", "Expense", "Loan", "EMI"])
+
+def compact_ledger(df):
+    """Converts transactions as an engine loads them into the compact in-memory ledger. Compact frames are returned as-is."""
+    if list(df.columns) == LEDGER_COLUMNS:
+        return df
+    df = df.reset_index(drop=True)
+    compact = pd.DataFrame(index=df.index)
+    if 'Id' in df.columns:
+        compact['Id'] = df['Id'].astype('int64')
+    if 'Date' in df.columns:
+        compact['Date'] = df['Date'] if pd.api.types.is_datetime64_any_dtype(df['Date']) else pd.to_datetime(df['Date'])
+    if 'Type' in df.columns:
+        compact['Type'] = df['Type'].astype(LEDGER_TYPE_DTYPE)
+    if 'Category' in df.columns:
+        compact['Category'] = df['Category'].astype('category')
+    if 'Amount' in df.columns:
+        compact['Paise'] = amounts_in_paise(df['Amount'])
+    if 'Note' in df.columns:
+        compact['Note'] = df['Note'].astype('category')
+    return compact
+
+def concat_categorical(frames, columns):
+    """Concatenates frames, keeping the given columns categorical even when their dictionaries differ."""
+    df = pd.concat(frames, ignore_index=True)
+    # Concatenating categoricals with different dictionaries falls back to object; re-unify them
+    for column in columns:
+        if column in df.columns and all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            df[column] = union_categoricals([frame[column] for frame in frames], ignore_order=True)
+    return df
+
+def ledger_display(ledger):
+    """Rows of a compact ledger with Amount back in rupees, as the transaction table shows them."""
+    return ledger.assign(Amount=ledger['Paise'] / 100)[QUERY_COLUMNS].reset_index(drop=True)
+
+
+# --- Transaction Queries ---
+# One page of a household's transactions for the "All Transactions" table. Every engine implements
+# query_transactions(username, **filters); filters are start/end dates, types, categories,
+# min_amount/max_amount, sort_by (one of QUERY_SORT_COLUMNS), descending, offset and limit.
+
+QUERY_SORT_COLUMNS = ["Date", "Amount", "Type", "Category"]
+QUERY_COLUMNS = ["Id", "Date", "Type", "Category", "Amount", "Note"] # Columns of a returned page
+
+def query_frame(df, start=None, end=None, types=None, categories=None, min_amount=None, max_amount=None,
+                sort_by="Date", descending=True, offset=0, limit=50):
+    """Filters, sorts and slices an in-memory ledger. Returns (page, number of matching rows)."""
+    if sort_by not in QUERY_SORT_COLUMNS:
+        raise ValueError(f"Cannot sort transactions by '{sort_by}'")
+    df = compact_ledger(df)
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= df['Date'] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= df['Date'] <= pd.Timestamp(end)
+    if types:
+        mask &= df['Type'].isin(types)
+    if categories:
+        mask &= df['Category'].isin(categories)
+    if min_amount is not None:
+        mask &= df['Paise'] >= to_paise(min_amount)
+    if max_amount is not None:
+        mask &= df['Paise'] <= to_paise(max_amount)
+    matches = df[mask]
+    # Categoricals sort by dictionary order; compare their labels instead
+    page = matches.sort_values('Paise' if sort_by == 'Amount' else sort_by, ascending=not descending, kind='stable',
+                               key=lambda column: column.astype(str) if isinstance(column.dtype, pd.CategoricalDtype) else column)
+    return ledger_display(page.iloc[offset:offset + limit]), len(matches)
+
+
+# --- Balance Totals ---
+# Per-household running totals by transaction Type, kept in integer paise so incremental
+# updates never drift from a rebuild: {"Income": {"paise": 100000, "count": 1}, ...}
+
+def to_paise(amount):
+    return int(round(float(amount) * 100)) if pd.notna(amount) else 0
+
+def amounts_in_paise(amounts):
+    """Vectorized to_paise for a column of rupee amounts."""
+    return (pd.to_numeric(amounts, errors='coerce').fillna(0) * 100).round().astype('int64')
+
+def totals_from_ledger(df):
+    """Recomputes the totals for one household from its raw transactions."""
+    if df.empty:
+        return {}
+    paise = amounts_in_paise(df['Amount'])
+    grouped = paise.groupby(df['Type'].astype(str)).agg(['sum', 'count'])
+    return {trans_type: {"paise": int(row['sum']), "count": int(row['count'])} for trans_type, row in grouped.iterrows()}
+
+def totals_in_rupees(totals):
+    return {trans_type: entry["paise"] / 100 for trans_type, entry in totals.items()}
+
+
+# --- Period Rollups ---
+# Per-household cube of (granularity, period, Type, Category) -> paise and count that the report
+# and trend charts read instead of regrouping the ledger. Periods are kept as formatted strings.
+
+ROLLUP_GRANULARITIES = {"Daily": '%Y-%m-%d', "Monthly": '%Y-%m', "Yearly": '%Y'} # Period label format
+ROLLUP_COLUMNS = ["Period", "Type", "Category", "Amount", "Count"]
+ROLLUP_PERIOD_LENGTH = {"Daily": 10, "Monthly": 7, "Yearly": 4} # Stored dates are 'YYYY-MM-DD', so a period is a prefix
+
+def rollup_from_ledger(df):
+    """Builds the rollup cube for one household: {granularity: {(period, type, category): [paise, count]}}."""
+    cube = {granularity: {} for granularity in ROLLUP_GRANULARITIES}
+    if df.empty:
+        return cube
+    dates = pd.to_datetime(df['Date'])
+    paise = amounts_in_paise(df['Amount'])
+    types, categories = df['Type'].astype(str), df['Category'].astype(str)
+    for granularity, period_format in ROLLUP_GRANULARITIES.items():
+        grouped = paise.groupby([mykhata_analytics.bucket_periods(dates, granularity), types, categories]).agg(['sum', 'count'])
+        # Only the (few) distinct periods get formatted, not every row
+        cube[granularity] = {(period.strftime(period_format), trans_type, category): [int(total), int(count)]
+                             for (period, trans_type, category), total, count in zip(grouped.index, grouped['sum'], grouped['count'])}
+    return cube
+
+def rollup_category(category):
+    """Category key of a rollup cell; the rollups table's NOT NULL Category holds '' for a missing one,
+    as rebuild_rollups() coalesces it."""
+    return "" if pd.isna(category) else category
+
+def add_to_rollup(cube, date_text, trans_type, category, amount, sign=1):
+    """Adds one transaction to the cube, or with sign=-1 takes one out again."""
+    for granularity, length in ROLLUP_PERIOD_LENGTH.items():
+        key = (date_text[:length], trans_type, category)
+        cell = cube[granularity].setdefault(key, [0, 0])
+        cell[0] += sign * to_paise(amount)
+        cell[1] += sign
+        if cell[1] == 0:
+            del cube[granularity][key]
+
+def rollup_frame(rows, granularity):
+    """Turns (period, type, category, paise, count) rows into a frame with Period as datetime64 and Amount in rupees."""
+    df = pd.DataFrame(rows, columns=["Period", "Type", "Category", "Paise", "Count"])
+    df['Period'] = pd.to_datetime(df['Period'], format=ROLLUP_GRANULARITIES[granularity])
+    df['Amount'] = df.pop('Paise') / 100
+    return df[ROLLUP_COLUMNS]
+
+
+# --- Append-Only CSV Indexes ---
+
+class AppendOnlyCsvIndex(abc.ABC):
+    """In-memory index over a CSV file that only ever grows by appended lines.
+
+    The file is read once per process and then only from where the last refresh() stopped,
+    which also picks up lines appended by other processes; a rewritten or replaced file is
+    re-indexed from scratch. Every record takes one line, which holds for everything the app
+    writes (single-line fields). Subclasses keep what they need in reset() and index_line().
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns # Replaced by the file's header once read
+        self.lock = threading.Lock()
+        self.inode = None
+        self.indexed = 0 # Bytes of the file covered by the index
+        self.reset()
+
+    @abc.abstractmethod
+    def reset(self):
+        """Empties the index."""
+
+    @abc.abstractmethod
+    def index_line(self, record, offset):
+        """Adds one record (a dict keyed by the file's columns) that starts at byte `offset`."""
+
+    def refresh(self):
+        """Indexes whatever was appended to the file since the last call. Costs one stat() when nothing was."""
+        stamp = file_stamp(self.path)
+        with self.lock:
+            if stamp is None:
+                self.inode, self.indexed = None, 0
+                self.reset()
+                return
+            inode, _, size = stamp
+            if inode != self.inode or size < self.indexed: # Replaced or truncated
+                self.inode, self.indexed = inode, 0
+                self.reset()
+            if size == self.indexed:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.indexed)
+                offset = self.indexed
+                for line in f:
+                    if not line.endswith(b"\n"): # A line still being appended; picked up next time
+                        break
+                    if offset == 0:
+                        self.columns = next(csv.reader([line.decode()]))
+                    elif line.strip():
+                        self.index_line(dict(zip(self.columns, next(csv.reader([line.decode()])))), offset)
+                    offset += len(line)
+                self.indexed = offset
+
+
+class UserDirectory(AppendOnlyCsvIndex):
+    """Hashed index of users_public_details.csv: username -> byte offset of the account's line.
+
+    A lookup is one dict probe plus one seek-and-read, however many accounts there are.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, USER_COLUMNS)
+
+    def reset(self):
+        self.offsets = {} # Username -> offset of its line; the first line wins if a legacy file repeats a name
+
+    def index_line(self, record, offset):
+        self.offsets.setdefault(record["Username"], offset)
+
+    def get(self, username):
+        """The account of `username` as a dict of USER_COLUMNS (missing values None), or None."""
+        for _ in range(2):
+            self.refresh()
+            offset = self.offsets.get(username)
+            if offset is None:
+                return None
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                line = f.readline().decode()
+            user = dict(zip(self.columns, next(csv.reader([line]), [])))
+            if user.get("Username") == username:
+                return {column: user.get(column) or None for column in USER_COLUMNS}
+            with self.lock: # The file was replaced since refresh() (e.g. by save_users()); re-index it and look again
+                self.inode = None
+        return None
+
+    def __contains__(self, username):
+        self.refresh()
+        return username in self.offsets
+
+
+class CategoryIndex(AppendOnlyCsvIndex):
+    """Every user's custom categories from category_memory.csv, held as username -> {name: type}."""
+
+    def __init__(self, path):
+        super().__init__(path, CATEGORY_COLUMNS)
+
+    def reset(self):
+        self.by_user = {}
+
+    def index_line(self, record, offset):
+        self.by_user.setdefault(record["Username"], {}).setdefault(record["CategoryName"], record["CategoryType"])
+
+    def categories(self, username):
+        """{category name: category type} of one user's custom categories."""
+        self.refresh()
+        return self.by_user.get(username, {})
+
+
+# --- CSV Storage ---
+
+class CsvStorage:
+    """Flat CSV files for users and categories, per-household partitions for the ledger.
+
+    read_only=True skips the one-time data migrations of a first start, for extra readers (such as
+    statement workers) of files that a normal open has already migrated."""
+
+    def __init__(self, root=".", read_only=False):
+        self.root = root
+        self.users_file = os.path.join(root, USERS_FILE)
+        self.lock_file = os.path.join(root, LOCK_FILE)
+        self.category_file = os.path.join(root, CATEGORY_FILE)
+        self.schedule_file = os.path.join(root, SCHEDULE_FILE)
+        self.ledger_dir = os.path.join(root, LEDGER_DIR)
+        self.directory = UserDirectory(self.users_file)
+        self.category_index = CategoryIndex(self.category_file)
+        self.lock = threading.RLock()
+        self.flocked = False # Whether the thread holding self.lock also holds the flock, so write_lock() can nest
+        self.appends = {} # Journal records per household since its last compaction
+        # Both are checked against the files on use, so writes from other app processes are picked up
+        self.totals = {} # Per household: (stamp of <user>.totals.json, balance totals)
+        self.rollups = {} # Per household: (ledger version it reflects, period rollup cube), built on first use
+        self.search_indexes = {} # Per household: (ledger version it reflects, mykhata_search.LedgerSearchIndex), likewise
+        self.build_locks = {} # Per household: held while one of the above is built, so it is built once
+        self.schedules = (None, None, 0) # (stamp of SCHEDULE_FILE, live schedules, records in the file)
+        self.compacting = set()
+        if not read_only:
+            self.split_legacy_ledger()
+            self.assign_missing_ids()
+
+    @contextmanager
+    def write_lock(self):
+        """Serializes writers in this process (self.lock) and across processes (flock on LOCK_FILE)."""
+        with self.lock:
+            if fcntl is None or self.flocked:
+                yield
+                return
+            with open(self.lock_file, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                self.flocked = True
+                try:
+                    yield
+                finally:
+                    self.flocked = False
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def version(self, kind, username=None):
+        """Changes whenever the files behind load_<kind>(username) change, including writes from other processes."""
+        if kind == "transactions":
+            paths = [self.partition_file(username), self.frozen_journal_file(username), self.journal_file(username)]
+        else:
+            paths = [{"users": self.users_file, "schedules": self.schedule_file}.get(kind, self.category_file)]
+        return tuple(file_stamp(path) for path in paths)
+
+    # Users
+
+    def load_users(self):
+        """Loads user data from CSV or creates an empty DataFrame."""
+        if os.path.exists(self.users_file):
+            return pd.read_csv(self.users_file)
+        df = pd.DataFrame(columns=USER_COLUMNS)
+        df.to_csv(self.users_file, index=False)
+        return df
+
+    def save_users(self, df):
+        """Saves user data to CSV."""
+        with self.write_lock():
+            df.to_csv(self.users_file + ".tmp", index=False)
+            os.replace(self.users_file + ".tmp", self.users_file)
+
+    def find_user(self, username):
+        """One account as a dict of USER_COLUMNS, or None; an index lookup rather than a file scan."""
+        return self.directory.get(username)
+
+    def add_user(self, user):
+        """Appends one account (a dict of USER_COLUMNS). Returns False if the username is taken."""
+        with self.write_lock():
+            if user["Username"] in self.directory:
+                return False
+            append_csv(pd.DataFrame([user], columns=USER_COLUMNS), self.users_file)
+            return True
+
+    # Transactions
+
+    PARTITION_SUFFIX = ".csv" # Compacted partition format; journals are always CSV
+
+    def partition_file(self, username, suffix=None):
+        """Path of a household's ledger partition. Usernames are quoted so any legacy name is a safe file name."""
+        return os.path.join(self.ledger_dir, quote(str(username), safe='') + (suffix or self.PARTITION_SUFFIX))
+
+    def journal_file(self, username):
+        return self.partition_file(username, ".journal.csv")
+
+    def frozen_journal_file(self, username):
+        return self.partition_file(username, ".journal.csv.compacting")
+
+    def read_partition(self, path, columns=None, start=None, end=None):
+        """Reads a partition, optionally only some columns. With start/end, only the blocks that can hold rows
+        of that date range are read (if the partition has a current block index); callers filter the rows."""
+        blocks = self.partition_blocks(path) if start is not None or end is not None else None
+        if not blocks:
+            return pd.read_csv(path, usecols=columns)
+        first_dates = [first_date for first_date, _ in blocks]
+        # Rows dated `start` can also end the block before the first one that starts at or after it
+        first = max(0, bisect.bisect_left(first_dates, date_text(start)) - 1) if start is not None else 0
+        stop = bisect.bisect_right(first_dates, date_text(end)) if end is not None else len(blocks)
+        with open(path, 'rb') as f:
+            header = f.readline()
+            if stop <= first:
+                return pd.read_csv(io.BytesIO(header), usecols=columns)
+            f.seek(blocks[first][1])
+            data = f.read(blocks[stop][1] - blocks[first][1]) if stop < len(blocks) else f.read()
+        return pd.read_csv(io.BytesIO(header + data), usecols=columns)
+
+    def partition_blocks(self, path):
+        """[first date, byte offset] of every block of a partition, or None if it has no index matching the file."""
+        try:
+            with open(path + ".blocks") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return index["blocks"] if tuple(index["stamp"]) == file_stamp(path) else None
+
+    def partition_columns(self, path):
+        return list(pd.read_csv(path, nrows=0).columns)
+
+    def read_journal(self, path):
+        return pd.read_csv(path)
+
+    def write_partition(self, df, path):
+        """Atomically replaces a compacted partition with df, minting Ids for rows that have none. A date-sorted
+        partition also gets a block index (<partition>.blocks): the first Date and byte offset of every
+        PARTITION_BLOCK_ROWS rows, tied to the file's stamp so a stale index is never used."""
+        df = with_ids(df)[TRANSACTION_COLUMNS]
+        dates = pd.to_datetime(df['Date'])
+        blocks = []
+        with open(path + ".tmp", 'wb') as f:
+            f.write(df.iloc[:0].to_csv(index=False).encode())
+            for start in range(0, len(df), PARTITION_BLOCK_ROWS):
+                blocks.append([str(dates.iloc[start])[:10], f.tell()])
+                f.write(df.iloc[start:start + PARTITION_BLOCK_ROWS].to_csv(index=False, header=False).encode())
+        if dates.notna().all() and dates.is_monotonic_increasing:
+            with open(path + ".blocks.tmp", 'w') as f:
+                json.dump({"stamp": file_stamp(path + ".tmp"), "blocks": blocks}, f)
+            os.replace(path + ".tmp", path)
+            os.replace(path + ".blocks.tmp", path + ".blocks")
+        else:
+            os.replace(path + ".tmp", path)
+
+    def concat_ledger(self, frames):
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def split_legacy_ledger(self):
+        """One-time migration of the shared DATA_FILE/JOURNAL_FILE into per-household partitions."""
+        os.makedirs(self.ledger_dir, exist_ok=True)
+        legacy_files = [os.path.join(self.root, name) for name in [DATA_FILE, JOURNAL_FILE + ".compacting", JOURNAL_FILE]]
+        legacy_files = [path for path in legacy_files if os.path.exists(path)]
+        if not legacy_files:
+            return
+        df = pd.concat([pd.read_csv(path) for path in legacy_files], ignore_index=True)
+        if 'Username' not in df.columns:
+            df['Username'] = ''
+        for username, rows in df.groupby('Username', sort=False):
+            self.merge_into_partition(username, self.read_journal_frame(rows))
+        for path in legacy_files:
+            os.replace(path, path + ".migrated")
+
+    def read_journal_frame(self, df):
+        """Brings raw journal rows into the partition's in-memory format."""
+        return df
+
+    def assign_missing_ids(self):
+        """One-time migration giving every transaction stored before Ids existed an Id, partitions and journals alike."""
+        marker = os.path.join(self.ledger_dir, ".ids-" + self.PARTITION_SUFFIX[1:])
+        if os.path.exists(marker):
+            return
+        with self.write_lock():
+            for username in self.usernames():
+                path = self.partition_file(username)
+                if os.path.exists(path) and 'Id' not in self.partition_columns(path):
+                    self.write_partition(self.read_partition(path), path)
+                for path in [self.frozen_journal_file(username), self.journal_file(username)]:
+                    if os.path.exists(path) and list(pd.read_csv(path, nrows=0).columns) != JOURNAL_COLUMNS:
+                        with_ids(pd.read_csv(path)).reindex(columns=JOURNAL_COLUMNS).to_csv(path + ".tmp", index=False)
+                        os.replace(path + ".tmp", path)
+            open(marker, 'w').close()
+
+    def merge_into_partition(self, username, rows):
+        path = self.partition_file(username)
+        if os.path.exists(path):
+            rows = self.concat_ledger([self.read_partition(path), rows])
+        self.write_partition(rows.sort_values('Date', kind='stable'), path)
+
+    def usernames(self):
+        """Every household that has a ledger partition."""
+        names = set()
+        for name in os.listdir(self.ledger_dir):
+            if ".journal.csv" in name:
+                names.add(name[:name.index(".journal.csv")])
+            elif name.endswith(self.PARTITION_SUFFIX):
+                names.add(name[:-len(self.PARTITION_SUFFIX)])
+        return sorted(unquote(name) for name in names)
+
+    def load_transactions(self, username, columns=None, start=None, end=None):
+        """Loads one household's transactions, optionally only some columns and only those dated start..end
+        (inclusive). Only that household's partition is read, and for a date range only the part holding it."""
+        # The ledger is the compacted partition plus any journal records not yet folded into it
+        base_file = self.partition_file(username)
+        journals = [self.frozen_journal_file(username), self.journal_file(username)]
+        windowed = start is not None or end is not None
+        # Read without self.lock, so a big ledger doesn't hold up other households' writes. A write (from any
+        # process) in between changes the files' version, and then they are read again, the last time under the lock.
+        for attempt in range(LEDGER_READ_ATTEMPTS):
+            with self.lock if attempt == LEDGER_READ_ATTEMPTS - 1 else nullcontext():
+                version = self.version("transactions", username)
+                try:
+                    journal_frames = [self.read_journal(path) for path in journals if os.path.exists(path)]
+                    # Edit and delete records are matched up with the records they revise by Id
+                    revised = any(frame['Op'].notna().any() for frame in journal_frames)
+                    wanted = columns and list(dict.fromkeys((['Id'] if revised else []) + (['Date'] if windowed else []) + list(columns)))
+                    frames = [self.read_partition(base_file, wanted, start, end)] if os.path.exists(base_file) else []
+                except (OSError, pd.errors.EmptyDataError): # Replaced or compacted away, or a new journal not yet written, meanwhile
+                    if attempt == LEDGER_READ_ATTEMPTS - 1:
+                        raise
+                    continue
+                frames += [frame[wanted + ['Op']] if wanted else frame for frame in journal_frames]
+                if self.version("transactions", username) == version:
+                    break
+        columns = columns or TRANSACTION_COLUMNS
+        if not frames:
+            return self.read_journal_frame(pd.DataFrame(columns=TRANSACTION_COLUMNS))[columns]
+        # The journal is applied whole: a record in it may move a transaction into or out of the range
+        return date_window(apply_journal_ops(self.concat_ledger(frames)), start, end)[columns]
+
+    def query_transactions(self, username, **filters):
+        """One filtered, sorted page of a household's transactions (see query_frame)."""
+        return query_frame(self.load_transactions(username, start=filters.get("start"), end=filters.get("end")), **filters)
+
+    def compact_journal(self, username):
+        """Folds a household's journal, edits and deletes included, into its date-sorted partition.
+        Runs in a background thread so writers are never blocked on it."""
+        frozen = self.frozen_journal_file(username)
+        with self.write_lock():
+            # Freeze the current journal; new appends start a fresh one while we merge
+            if not os.path.exists(frozen):
+                if not os.path.exists(self.journal_file(username)):
+                    self.compacting.discard(username)
+                    return
+                with self.ledger_change(username):
+                    os.replace(self.journal_file(username), frozen)
+            self.appends[username] = 0
+        try:
+            base_file = self.partition_file(username)
+            # Stamped before reading: another app process may finish this compaction, and freeze a newer journal, meanwhile
+            stamps = (file_stamp(base_file), file_stamp(frozen))
+            if stamps[1] is None:
+                return
+            frames = [self.read_partition(base_file)] if stamps[0] is not None else []
+            merged = apply_journal_ops(self.concat_ledger(frames + [self.read_journal(frozen)])).sort_values('Date', kind='stable')
+            with self.write_lock(), self.ledger_change(username):
+                if (file_stamp(base_file), file_stamp(frozen)) == stamps: # Else the merge is of files since replaced
+                    self.write_partition(merged, base_file)
+                    os.remove(frozen)
+        finally:
+            self.compacting.discard(username)
+
+    def append_transaction(self, username, date, trans_type, category, amount, note, transaction_id=None):
+        """Appends a single transaction to the household's journal. Costs O(1) regardless of ledger size."""
+        return self.append_transactions(transaction_rows([(username, date, trans_type, category, amount, note, transaction_id)]))
+
+    def append_transactions(self, rows):
+        """Appends a batch of rows (see transaction_rows) with one write and one fsync per household journal."""
+        rows = with_ids(rows)
+        start_compaction = []
+        with self.write_lock():
+            for username, user_rows in rows.groupby('Username', sort=False):
+                self.read_totals(username) # Build missing totals before these rows land in the ledger
+                with self.ledger_change(username) as (cube, index):
+                    append_csv(user_rows.reindex(columns=JOURNAL_COLUMNS), self.journal_file(username))
+                    # Either is otherwise built from the ledger, these rows included, on first use
+                    for row in user_rows.itertuples(index=False):
+                        if cube is not None:
+                            add_to_rollup(cube, row.Date, row.Type, row.Category, row.Amount)
+                        if index is not None:
+                            index.add(row.Id, row.Date, row.Type, row.Category, row.Amount, row.Note)
+                self.add_to_totals(username, zip(user_rows['Type'], user_rows['Amount'], itertools.repeat(1)))
+                if self.count_journal_records(username, len(user_rows)):
+                    start_compaction.append(username)
+        for username in start_compaction:
+            threading.Thread(target=self.compact_journal, args=(username,), daemon=True).start()
+        return self.read_journal_frame(rows)
+
+    def update_transaction(self, username, transaction_id, date, trans_type, category, amount, note, old_date=None):
+        """Replaces a transaction by appending a replacement record to the journal. Returns the new row, or None if
+        the household has no such transaction. `old_date`, the date it was last seen with, saves reading the whole ledger."""
+        row = transaction_rows([(username, date, trans_type, category, amount, note, transaction_id)])
+        return row if self.revise_transaction(username, transaction_id, row, old_date) else None
+
+    def delete_transaction(self, username, transaction_id, old_date=None):
+        """Deletes a transaction by appending a tombstone record to the journal. Returns False if the household has no such transaction."""
+        return self.revise_transaction(username, transaction_id, old_date=old_date)
+
+    def find_transaction(self, username, transaction_id, date=None):
+        """Current values of one transaction, or None. Only its records are looked at: the journal's last one if
+        it has any, else its partition row, read from the block of `date` (the date it was last seen with) and
+        from the whole partition only if it isn't there."""
+        base_file = self.partition_file(username)
+        with self.lock:
+            # A journal record supersedes the partition row and any earlier record
+            for path in [self.journal_file(username), self.frozen_journal_file(username)]:
+                if os.path.exists(path):
+                    records = self.read_journal(path)
+                    records = records[records['Id'] == transaction_id]
+                    if not records.empty:
+                        return None if records['Op'].iloc[-1] == JOURNAL_DELETE else records.iloc[-1]
+            if not os.path.exists(base_file):
+                return None
+            for start in ([date] if date is not None else []) + [None]:
+                rows = self.read_partition(base_file, start=start, end=start)
+                rows = rows[rows['Id'] == transaction_id]
+                if not rows.empty:
+                    return rows.iloc[-1]
+        return None
+
+    def revise_transaction(self, username, transaction_id, row=None, old_date=None):
+        """Appends an edit record (`row`, see transaction_rows) or a tombstone for one transaction and moves its
+        old values, found by find_transaction(), out of the totals and rollups."""
+        start_compaction = False
+        with self.write_lock():
+            old = self.find_transaction(username, transaction_id, old_date)
+            if old is None:
+                return False
+            old_record = (pd.Timestamp(old['Date']).strftime('%Y-%m-%d'), str(old['Type']), str(old['Category']), old['Amount'])
+            # A tombstone repeats the values it deletes, so the journal reads as a history
+            record = row if row is not None else transaction_rows([(username, pd.Timestamp(old['Date']), old['Type'], old['Category'],
+                                                                    old['Amount'], old['Note'], transaction_id)])
+            self.read_totals(username)
+            with self.ledger_change(username) as (cube, index):
+                append_csv(record.assign(Op=JOURNAL_EDIT if row is not None else JOURNAL_DELETE)[JOURNAL_COLUMNS], self.journal_file(username))
+                new = row.iloc[0] if row is not None else None
+                if cube is not None:
+                    add_to_rollup(cube, *old_record, sign=-1)
+                    if new is not None:
+                        add_to_rollup(cube, new['Date'], new['Type'], new['Category'], new['Amount'])
+                if index is not None:
+                    index.remove(transaction_id)
+                    if new is not None:
+                        index.add(transaction_id, new['Date'], new['Type'], new['Category'], new['Amount'], new['Note'])
+            entries = [(old_record[1], old_record[3], -1)]
+            if row is not None:
+                entries.append((row['Type'].iloc[0], row['Amount'].iloc[0], 1))
+            self.add_to_totals(username, entries)
+            start_compaction = self.count_journal_records(username, 1)
+        if start_compaction:
+            threading.Thread(target=self.compact_journal, args=(username,), daemon=True).start()
+        return True
+
+    def count_journal_records(self, username, count):
+        """Counts records appended to a household's journal. True if a compaction should be started now (under write_lock)."""
+        self.appends[username] = self.appends.get(username, 0) + count
+        if self.appends[username] >= COMPACT_EVERY and username not in self.compacting:
+            self.compacting.add(username)
+            return True
+        return False
+
+    @contextmanager
+    def ledger_change(self, username):
+        """Wraps a change to a household's ledger files (under write_lock). Yields its (rollup cube, search index),
+        each None unless it was up to date, for the caller to update; those are then marked current again, stale ones dropped."""
+        version = self.version("transactions", username)
+        caches = (self.rollups, self.search_indexes)
+        current = [entry[1] if entry is not None and entry[0] == version else None for entry in (cache.get(username) for cache in caches)]
+        yield tuple(current)
+        version = self.version("transactions", username)
+        for cache, value in zip(caches, current):
+            if value is not None:
+                cache[username] = (version, value)
+            else:
+                cache.pop(username, None)
+
+    def cached_build(self, cache, username, build):
+        """A household's entry in `cache` (rollups or search_indexes), built by build() unless it is current.
+        Only that household's build lock is held while building, so other households' writes don't wait on
+        the O(ledger) build; it is kept only if the ledger hasn't changed meanwhile. Read it under self.lock."""
+        with self.lock:
+            build_lock = self.build_locks.setdefault(username, threading.Lock())
+        with build_lock:
+            with self.lock:
+                version = self.version("transactions", username)
+                if cache.get(username, (None,))[0] == version: # Else not built yet, or changed by a write since
+                    return cache[username][1]
+            value = build()
+            with self.lock:
+                if self.version("transactions", username) == version:
+                    cache[username] = (version, value)
+            return value
+
+    # Balance totals
+
+    def totals_file(self, username):
+        return self.partition_file(username, ".totals.json")
+
+    def read_totals(self, username):
+        stamp = file_stamp(self.totals_file(username))
+        entry = self.totals.get(username)
+        if entry is None or entry[0] != stamp: # Not loaded yet, or rewritten by another process
+            if stamp is None: # First use after an upgrade
+                with self.write_lock(): # Another process may have built them, or appended, meanwhile
+                    stamp = file_stamp(self.totals_file(username))
+                    if stamp is None:
+                        return self.rebuild_totals(username)
+            with open(self.totals_file(username)) as f:
+                self.totals[username] = (stamp, json.load(f))
+        return self.totals[username][1]
+
+    def write_totals(self, username, totals):
+        with open(self.totals_file(username) + ".tmp", "w") as f:
+            json.dump(totals, f)
+        os.replace(self.totals_file(username) + ".tmp", self.totals_file(username))
+        self.totals[username] = (file_stamp(self.totals_file(username)), totals)
+
+    def add_to_totals(self, username, entries):
+        """Applies (type, amount, sign) entries to a household's totals and stores them once; sign -1 takes a transaction out."""
+        with self.lock:
+            totals = dict(self.read_totals(username))
+            for trans_type, amount, sign in entries:
+                entry = totals.get(trans_type, {"paise": 0, "count": 0})
+                entry = {"paise": entry["paise"] + sign * to_paise(amount), "count": entry["count"] + sign}
+                if entry["count"]:
+                    totals[trans_type] = entry
+                else: # As a rebuild from the ledger would have it
+                    totals.pop(trans_type, None)
+            self.write_totals(username, totals)
+
+    def load_totals(self, username):
+        """Balance totals in rupees by transaction Type, maintained on every write."""
+        with self.lock:
+            return totals_in_rupees(self.read_totals(username))
+
+    def rebuild_totals(self, username):
+        """Recomputes a household's totals from its raw ledger and stores them. Returns the rebuilt totals."""
+        with self.write_lock(): # So no append lands between reading the ledger and storing its totals
+            totals = totals_from_ledger(self.load_transactions(username, columns=['Type', 'Amount']))
+            self.write_totals(username, totals)
+            return totals
+
+    def verify_totals(self, username):
+        """True if the stored totals match a recomputation from the raw ledger."""
+        with self.lock:
+            return self.read_totals(username) == totals_from_ledger(self.load_transactions(username, columns=['Type', 'Amount']))
+
+    # Period rollups
+
+    def load_rollup(self, username, granularity):
+        """Amount and count per (Period, Type, Category) at "Daily", "Monthly" or "Yearly" granularity."""
+        cube = self.cached_build(self.rollups, username, lambda: rollup_from_ledger(
+            self.load_transactions(username, columns=['Date', 'Type', 'Category', 'Amount'])))
+        with self.lock:
+            cells = cube[granularity]
+            return rollup_frame([(*key, paise, count) for key, (paise, count) in cells.items()], granularity)
+
+    # Full-text search
+
+    def search_transactions(self, username, query, start=None, end=None, types=None, offset=0, limit=50):
+        """A household's transactions whose note or category has words starting with those of `query`, best match
+        first (see mykhata_search). Returns (page with a Score column, number of matches)."""
+        index = self.cached_build(self.search_indexes, username, lambda: mykhata_search.LedgerSearchIndex(self.load_transactions(username)))
+        with self.lock:
+            return index.search(query, start, end, types, offset, limit)
+
+    # Categories
+
+    def load_categories(self, username):
+        """Loads custom categories for a user, from the category index rather than a file scan."""
+        if not os.path.exists(self.category_file):
+            pd.DataFrame(columns=CATEGORY_COLUMNS).to_csv(self.category_file, index=False)
+        categories = self.category_index.categories(username)
+        return pd.DataFrame([[username, category_type, name] for name, category_type in categories.items()], columns=CATEGORY_COLUMNS)
+
+    def save_category(self, username, category_type, category_name):
+        """Saves a custom category for a user by appending one line. Returns False if the user already has it."""
+        with self.write_lock():
+            if not os.path.exists(self.category_file):
+                pd.DataFrame(columns=CATEGORY_COLUMNS).to_csv(self.category_file, index=False)
+            if category_name in self.category_index.categories(username):
+                return False
+            append_csv(pd.DataFrame([[username, category_type, category_name]], columns=CATEGORY_COLUMNS), self.category_file)
+            return True
+
+    # Payment schedules
+
+    def read_schedules(self):
+        """(every live schedule, number of records in the schedule file), reread only when the file changed."""
+        stamp = file_stamp(self.schedule_file)
+        if self.schedules[1] is None or self.schedules[0] != stamp:
+            records = pd.read_csv(self.schedule_file) if stamp is not None else pd.DataFrame(columns=SCHEDULE_RECORD_COLUMNS)
+            live = records.drop_duplicates('Id', keep='last')
+            self.schedules = (stamp, schedule_frame(live[live['Op'] != JOURNAL_DELETE].reset_index(drop=True)), len(records))
+        return self.schedules[1], self.schedules[2]
+
+    def load_schedules(self, username=None):
+        """Payment schedules of one household, or of every household."""
+        with self.lock:
+            schedules, _ = self.read_schedules()
+        return schedules if username is None else schedules[schedules['Username'] == username].reset_index(drop=True)
+
+    def save_schedules(self, rows):
+        """Adds or replaces schedules (see schedule_rows) by appending their records."""
+        with self.write_lock():
+            append_csv(rows.reindex(columns=SCHEDULE_RECORD_COLUMNS), self.schedule_file)
+            self.compact_schedules()
+        return rows
+
+    def delete_schedule(self, username, schedule_id):
+        """Deletes one of a household's schedules by appending a tombstone. Returns False if it has no such schedule."""
+        with self.write_lock():
+            schedules, _ = self.read_schedules()
+            schedule = schedules[(schedules['Id'] == schedule_id) & (schedules['Username'] == username)]
+            if schedule.empty:
+                return False
+            append_csv(schedule.assign(Op=JOURNAL_DELETE)[SCHEDULE_RECORD_COLUMNS], self.schedule_file)
+            self.compact_schedules()
+            return True
+
+    def compact_schedules(self):
+        """Rewrites the schedule file without superseded records once they outnumber the live ones (under write_lock)."""
+        schedules, records = self.read_schedules()
+        if records > 2 * len(schedules) + 100:
+            schedules.reindex(columns=SCHEDULE_RECORD_COLUMNS).to_csv(self.schedule_file + ".tmp", index=False)
+            os.replace(self.schedule_file + ".tmp", self.schedule_file)
+
+    def post_due_schedules(self, until, usernames=None, schedule_ids=None):
+        """Records every payment due on or before `until` as a transaction, in one batch, and moves the schedules past
+        them. Covers the auto-posting schedules of every household (or of `usernames`), or the schedules `schedule_ids`
+        whatever their setting. Returns the transaction rows posted."""
+        with self.write_lock():
+            schedules = due_schedules(self.read_schedules()[0], usernames, schedule_ids)
+            records, paid = mykhata_schedules.payments_due(mykhata_schedules.DueQueue(schedules), until)
+            if not records:
+                return transaction_rows([])
+            rows = self.append_transactions(transaction_rows(records))
+            self.save_schedules(schedules[schedules['Id'].isin(paid)].assign(Paid=lambda df: df['Id'].map(paid)))
+            return rows
+
+
+# --- Parquet Storage ---
+
+PARQUET_ROW_GROUP_SIZE = 10_000 # Rows per row group; partitions are date-sorted so date filters skip whole groups
+
+
+class ParquetStorage(CsvStorage):
+    """Typed, columnar ledger partitions (<user>.parquet) with the same CSV journal in front of them.
+
+    Date is stored as a timestamp, Amount as integer paise and Type/Category as dictionary-encoded
+    columns, so loads come back as datetime64/float64/category with no parsing or coercion.
+    Existing CSV partitions are converted on first start.
+    """
+
+    PARTITION_SUFFIX = ".parquet"
+
+    def __init__(self, root=".", read_only=False):
+        if pq is None:
+            raise ImportError("The parquet storage engine needs pyarrow: pip install pyarrow")
+        super().__init__(root, read_only)
+        if not read_only:
+            self.convert_csv_partitions()
+
+    def convert_csv_partitions(self):
+        for name in os.listdir(self.ledger_dir):
+            if name.endswith(".csv") and ".journal.csv" not in name:
+                path = os.path.join(self.ledger_dir, name)
+                self.merge_into_partition(unquote(name[:-len(".csv")]), self.read_journal_frame(pd.read_csv(path)))
+                os.replace(path, path + ".migrated")
+
+    def read_partition(self, path, columns=None, start=None, end=None):
+        """Reads only the requested columns, and with start/end only the row groups (and rows) of that date range."""
+        filters = [("Date", ">=", pd.Timestamp(start))] if start is not None else []
+        filters += [("Date", "<=", pd.Timestamp(end))] if end is not None else []
+        df = pq.read_table(path, columns=columns, filters=filters or None).to_pandas()
+        if 'Amount' in df.columns:
+            df['Amount'] = df['Amount'] / 100 # Stored as integer paise
+        return df
+
+    def partition_columns(self, path):
+        return pq.read_schema(path).names
+
+    def read_journal(self, path):
+        return self.read_journal_frame(pd.read_csv(path))
+
+    def read_journal_frame(self, df):
+        df = df.copy()
+        if 'Date' in df.columns:
+            df['Date'] = pd.to_datetime(df['Date'])
+        if 'Amount' in df.columns:
+            df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce').fillna(0).astype('float64')
+        for column in ['Username', 'Type', 'Category']:
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+        return df
+
+    def concat_ledger(self, frames):
+        if len(frames) == 1:
+            return frames[0]
+        return concat_categorical(frames, ['Username', 'Type', 'Category'])
+
+    def write_partition(self, df, path):
+        df = with_ids(df)
+        table = pa.Table.from_pandas(pd.DataFrame({
+            "Id": df['Id'],
+            "Username": df['Username'].astype(str),
+            "Date": pd.to_datetime(df['Date']),
+            "Type": df['Type'].astype(str),
+            "Category": df['Category'].astype(str),
+            "Amount": amounts_in_paise(df['Amount']),
+            "Note": df['Note'].astype(object).where(df['Note'].notna(), None),
+        }), schema=PARQUET_SCHEMA, preserve_index=False)
+        pq.write_table(table, path + ".tmp", row_group_size=PARQUET_ROW_GROUP_SIZE)
+        os.replace(path + ".tmp", path)
+
+
+# --- SQLite Storage ---
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    Username TEXT PRIMARY KEY,
+    PasswordHash TEXT NOT NULL,
+    Name TEXT,
+    Mobile TEXT,
+    Email TEXT,
+    Role TEXT,
+    ParentUsername TEXT
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    Id INTEGER NOT NULL,
+    Username TEXT NOT NULL,
+    Date TEXT NOT NULL,
+    Type TEXT NOT NULL,
+    Category TEXT,
+    Amount REAL NOT NULL,
+    Note TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (Username, Date);
+CREATE TABLE IF NOT EXISTS categories (
+    Username TEXT NOT NULL,
+    CategoryType TEXT NOT NULL,
+    CategoryName TEXT NOT NULL,
+    UNIQUE (Username, CategoryName)
+);
+CREATE INDEX IF NOT EXISTS idx_categories_user_type ON categories (Username, CategoryType);
+CREATE TABLE IF NOT EXISTS totals (
+    Username TEXT NOT NULL,
+    Type TEXT NOT NULL,
+    Paise INTEGER NOT NULL,
+    Count INTEGER NOT NULL,
+    PRIMARY KEY (Username, Type)
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    Id INTEGER PRIMARY KEY,
+    Username TEXT NOT NULL,
+    Type TEXT NOT NULL,
+    Category TEXT NOT NULL,
+    Amount REAL NOT NULL,
+    Frequency TEXT NOT NULL,
+    StartDate TEXT NOT NULL,
+    Payments INTEGER NOT NULL,
+    Paid INTEGER NOT NULL,
+    AutoPost INTEGER NOT NULL,
+    Note TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_schedules_user ON schedules (Username);
+"""
+
+SQLITE_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    Username TEXT NOT NULL,
+    Granularity TEXT NOT NULL,
+    Period TEXT NOT NULL,
+    Type TEXT NOT NULL,
+    Category TEXT NOT NULL,
+    Paise INTEGER NOT NULL,
+    Count INTEGER NOT NULL,
+    PRIMARY KEY (Username, Granularity, Period, Type, Category)
+);
+"""
+
+# Write generation per (kind, household), bumped inside every write transaction, so that every process's
+# caches see the writes of every other process (see SqliteStorage.version()). Username is '' for kinds kept per database.
+SQLITE_VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    Kind TEXT NOT NULL,
+    Username TEXT NOT NULL,
+    Generation INTEGER NOT NULL,
+    PRIMARY KEY (Kind, Username)
+) WITHOUT ROWID;
+"""
+
+SQLITE_ID_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_id ON transactions (Id);
+"""
+
+# Full-text index over notes and categories, kept in step with the transactions table by triggers.
+# Its rowid is the transaction Id; Username is indexed too, to narrow a search to one household inside FTS5.
+SQLITE_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS transactions_search USING fts5 (Username, Note, Category);
+CREATE TRIGGER IF NOT EXISTS transactions_search_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO transactions_search (rowid, Username, Note, Category) VALUES (new.Id, new.Username, new.Note, new.Category);
+END;
+CREATE TRIGGER IF NOT EXISTS transactions_search_delete AFTER DELETE ON transactions BEGIN
+    DELETE FROM transactions_search WHERE rowid = old.Id;
+END;
+CREATE TRIGGER IF NOT EXISTS transactions_search_update AFTER UPDATE ON transactions BEGIN
+    DELETE FROM transactions_search WHERE rowid = old.Id;
+    INSERT INTO transactions_search (rowid, Username, Note, Category) VALUES (new.Id, new.Username, new.Note, new.Category);
+END;
+"""
+
+SQLITE_INSERT_TRANSACTION = f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) VALUES ({', '.join('?' * len(TRANSACTION_COLUMNS))})"
+
+SQLITE_SAVE_SCHEDULE = f"INSERT OR REPLACE INTO schedules ({', '.join(SCHEDULE_COLUMNS)}) VALUES ({', '.join('?' * len(SCHEDULE_COLUMNS))})"
+
+SQLITE_ADD_TO_TOTALS = ("INSERT INTO totals VALUES (?, ?, ?, ?) ON CONFLICT (Username, Type) DO UPDATE SET "
+                        "Paise = Paise + excluded.Paise, Count = Count + excluded.Count")
+
+SQLITE_ADD_TO_ROLLUPS = ("INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (Username, Granularity, Period, Type, Category) "
+                         "DO UPDATE SET Paise = Paise + excluded.Paise, Count = Count + excluded.Count")
+
+SQLITE_REBUILD_TOTALS = """
+INSERT INTO totals (Username, Type, Paise, Count)
+SELECT Username, Type, SUM(CAST(ROUND(Amount * 100) AS INTEGER)), COUNT(*) FROM transactions {where} GROUP BY Username, Type
+"""
+
+
+class SqliteStorage:
+    """Embedded SQLite database in WAL mode. Every call is an indexed query or a single-row write.
+
+    read_only=True opens read-only connections and skips the schema setup and migrations."""
+
+    NATIVE_QUERIES = True # query_transactions() pages in SQL rather than over a loaded frame
+
+    def __init__(self, path=SQLITE_FILE, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.local = threading.local() # sqlite3 connections can't be shared between threads
+        if read_only:
+            return
+        conn = self.connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transactions'").fetchone() and \
+                "Id" not in [column[1] for column in conn.execute("PRAGMA table_info(transactions)")]:
+            with conn: # Database created before transactions had Ids
+                conn.execute("ALTER TABLE transactions ADD COLUMN Id INTEGER")
+                conn.execute("UPDATE transactions SET Id = random() & 9223372036854775807")
+        has_totals = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'totals'").fetchone()
+        conn.executescript(SQLITE_SCHEMA)
+        if not has_totals: # Database created before totals were kept
+            self.rebuild_totals()
+        has_rollups = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollups'").fetchone()
+        conn.executescript(SQLITE_ROLLUP_SCHEMA)
+        if not has_rollups:
+            self.rebuild_rollups()
+        conn.executescript(SQLITE_ID_INDEX)
+        conn.executescript(SQLITE_VERSION_SCHEMA)
+        has_search = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transactions_search'").fetchone()
+        with conn:
+            conn.executescript(SQLITE_SEARCH_SCHEMA)
+            if not has_search: # Database created before transactions were searchable
+                conn.execute("INSERT INTO transactions_search (rowid, Username, Note, Category) SELECT Id, Username, Note, Category FROM transactions")
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.path))}?mode=ro", uri=True, timeout=30)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; only the last commit can be lost on power failure
+            self.local.conn = conn
+        return conn
+
+    def version(self, kind, username=None):
+        """Changes whenever any process writes what load_<kind>(username) returns; a primary-key lookup."""
+        row = self.connect().execute("SELECT Generation FROM versions WHERE Kind = ? AND Username = ?", (kind, username or "")).fetchone()
+        return 0 if row is None else row[0]
+
+    def bump(self, conn, kind, username=None):
+        """Moves on the version of load_<kind>(username), inside the caller's SQLite transaction."""
+        conn.execute("INSERT INTO versions VALUES (?, ?, 1) ON CONFLICT (Kind, Username) DO UPDATE SET Generation = Generation + 1",
+                     (kind, username or ""))
+
+    def query(self, sql, params=(), columns=None):
+        df = pd.read_sql_query(sql, self.connect(), params=params)
+        return df if columns is None else df[columns]
+
+    # Users
+
+    def load_users(self):
+        """Loads every user account."""
+        return self.query("SELECT * FROM users", columns=USER_COLUMNS)
+
+    def find_user(self, username):
+        """One account as a dict of USER_COLUMNS, or None; a primary-key lookup."""
+        row = self.connect().execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE Username = ?", (username,)).fetchone()
+        return None if row is None else dict(zip(USER_COLUMNS, row))
+
+    def save_users(self, df):
+        """Replaces the user table with df."""
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany(f"INSERT INTO users VALUES ({','.join('?' * len(USER_COLUMNS))})",
+                             df[USER_COLUMNS].astype(object).where(df[USER_COLUMNS].notna(), None).itertuples(index=False))
+            self.bump(conn, "users")
+
+    def add_user(self, user):
+        """Inserts one account (a dict of USER_COLUMNS). Returns False if the username is taken."""
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(f"INSERT INTO users VALUES ({','.join('?' * len(USER_COLUMNS))})",
+                             [None if pd.isna(user.get(column)) else user.get(column) for column in USER_COLUMNS])
+                self.bump(conn, "users")
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    # Transactions
+
+    def usernames(self):
+        return [row[0] for row in self.connect().execute("SELECT DISTINCT Username FROM transactions ORDER BY Username")]
+
+    def load_transactions(self, username, columns=None, start=None, end=None):
+        """Loads one household's transactions, optionally only some columns and only those dated start..end
+        (inclusive), through the (Username, Date) index."""
+        columns = [column for column in TRANSACTION_COLUMNS if column in (columns or TRANSACTION_COLUMNS)]
+        clauses, params = ["Username = ?"], [username]
+        if start is not None:
+            clauses.append("Date >= ?")
+            params.append(date_text(start))
+        if end is not None:
+            clauses.append("Date <= ?")
+            params.append(date_text(end))
+        return self.query(f"SELECT {', '.join(columns)} FROM transactions WHERE {' AND '.join(clauses)} ORDER BY Date", params)
+
+    def append_transaction(self, username, date, trans_type, category, amount, note, transaction_id=None):
+        """Inserts a single transaction row."""
+        return self.append_transactions(transaction_rows([(username, date, trans_type, category, amount, note, transaction_id)]))
+
+    def append_transactions(self, rows):
+        """Inserts a batch of rows (see transaction_rows), with their totals and rollups, in one SQLite transaction."""
+        rows = with_ids(rows)
+        conn = self.connect()
+        with conn:
+            self.insert_transactions(conn, rows)
+        return rows
+
+    def insert_transactions(self, conn, rows):
+        """Inserts rows with Ids and adds them to the totals and rollups, inside the caller's SQLite transaction."""
+        totals, rollups = {}, {}
+        for row in rows.itertuples(index=False):
+            paise = to_paise(row.Amount)
+            cell = totals.setdefault((row.Username, row.Type), [0, 0])
+            cell[0] += paise
+            cell[1] += 1
+            for granularity, length in ROLLUP_PERIOD_LENGTH.items():
+                cell = rollups.setdefault((row.Username, granularity, row.Date[:length], row.Type, rollup_category(row.Category)), [0, 0])
+                cell[0] += paise
+                cell[1] += 1
+        conn.executemany(SQLITE_INSERT_TRANSACTION,
+                         rows[TRANSACTION_COLUMNS].astype(object).where(rows[TRANSACTION_COLUMNS].notna(), None).itertuples(index=False))
+        conn.executemany(SQLITE_ADD_TO_TOTALS, [(*key, paise, count) for key, (paise, count) in totals.items()])
+        conn.executemany(SQLITE_ADD_TO_ROLLUPS, [(*key, paise, count) for key, (paise, count) in rollups.items()])
+        for username in rows['Username'].unique():
+            self.bump(conn, "transactions", username)
+
+    def update_transaction(self, username, transaction_id, date, trans_type, category, amount, note, old_date=None):
+        """Rewrites one transaction row in place. Returns the new row, or None if the household has no such transaction.
+        `old_date` is accepted for the file engines' sake; the Id index finds the row without it."""
+        row = transaction_rows([(username, date, trans_type, category, amount, note, transaction_id)])
+        return row if self.revise_transaction(username, transaction_id, row) else None
+
+    def delete_transaction(self, username, transaction_id, old_date=None):
+        """Deletes one transaction row. Returns False if the household has no such transaction."""
+        return self.revise_transaction(username, transaction_id)
+
+    def revise_transaction(self, username, transaction_id, row=None):
+        """Updates (`row` given, see transaction_rows) or deletes one transaction through the Id index and moves
+        its totals and rollups, in one SQLite transaction."""
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE") # Nobody can change the row between reading and rewriting it
+            old = conn.execute("SELECT Date, Type, Category, Amount FROM transactions WHERE Id = ? AND Username = ?",
+                               (int(transaction_id), username)).fetchone()
+            if old is None:
+                return False
+            changes = [(old, -1)]
+            if row is None:
+                conn.execute("DELETE FROM transactions WHERE Id = ?", (int(transaction_id),))
+            else:
+                new = row.iloc[0]
+                conn.execute("UPDATE transactions SET Date = ?, Type = ?, Category = ?, Amount = ?, Note = ? WHERE Id = ?",
+                             (new['Date'], new['Type'], new['Category'], float(new['Amount']), new['Note'], int(transaction_id)))
+                changes.append(((new['Date'], new['Type'], new['Category'], new['Amount']), 1))
+            for (date, trans_type, category, amount), sign in changes:
+                paise = sign * to_paise(amount)
+                conn.execute(SQLITE_ADD_TO_TOTALS, (username, trans_type, paise, sign))
+                conn.executemany(SQLITE_ADD_TO_ROLLUPS, [(username, granularity, date[:length], trans_type, rollup_category(category), paise, sign)
+                                                         for granularity, length in ROLLUP_PERIOD_LENGTH.items()])
+            # As a rebuild from the ledger would have it
+            conn.execute("DELETE FROM totals WHERE Username = ? AND Count = 0", (username,))
+            conn.execute("DELETE FROM rollups WHERE Username = ? AND Count = 0", (username,))
+            self.bump(conn, "transactions", username)
+        return True
+
+    def query_transactions(self, username, start=None, end=None, types=None, categories=None, min_amount=None, max_amount=None,
+                           sort_by="Date", descending=True, offset=0, limit=50):
+        """One filtered, sorted page of a household's transactions. Only that page's rows are fetched."""
+        if sort_by not in QUERY_SORT_COLUMNS:
+            raise ValueError(f"Cannot sort transactions by '{sort_by}'")
+        clauses, params = ["Username = ?"], [username]
+        if start is not None:
+            clauses.append("Date >= ?")
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            clauses.append("Date <= ?")
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        for column, values in [("Type", types), ("Category", categories)]:
+            if values:
+                clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if min_amount is not None:
+            clauses.append("Amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            clauses.append("Amount <= ?")
+            params.append(max_amount)
+        where = " AND ".join(clauses)
+        direction = "DESC" if descending else "ASC"
+        total = self.connect().execute(f"SELECT COUNT(*) FROM transactions WHERE {where}", params).fetchone()[0]
+        page = self.query(f"SELECT {', '.join(QUERY_COLUMNS)} FROM transactions WHERE {where} "
+                          f"ORDER BY {sort_by} {direction}, rowid {direction} LIMIT ? OFFSET ?", params + [limit, offset])
+        return with_ledger_types(page), total
+
+    def search_transactions(self, username, query, start=None, end=None, types=None, offset=0, limit=50):
+        """A household's transactions whose note or category has words starting with those of `query`, best match
+        first (FTS5's bm25, then newest). Returns (page with a Score column, number of matches)."""
+        tokens = mykhata_search.query_tokens(query)
+        if not tokens:
+            return pd.DataFrame(columns=mykhata_search.RESULT_COLUMNS), 0
+        match = "{Note Category}: (" + " OR ".join(f'"{token}"*' for token in tokens) + ")"
+        user_words = re.findall(r"[^\W_]+", username) # As FTS5 tokenizes it; the exact match is checked on the row
+        if user_words:
+            match = f'Username: "{" ".join(user_words)}" AND {match}'
+        clauses, params = ["transactions_search MATCH ?", "t.Username = ?"], [match, username]
+        if start is not None:
+            clauses.append("t.Date >= ?")
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            clauses.append("t.Date <= ?")
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        if types:
+            clauses.append(f"t.Type IN ({','.join('?' * len(types))})")
+            params.extend(types)
+        # CROSS JOIN keeps FTS5 as the outer loop; otherwise SQLite may run the MATCH once per row of the household
+        source = f"transactions_search CROSS JOIN transactions t ON t.Id = transactions_search.rowid WHERE {' AND '.join(clauses)}"
+        total = self.connect().execute(f"SELECT COUNT(*) FROM {source}", params).fetchone()[0]
+        page = self.query(f"SELECT {', '.join('t.' + column for column in QUERY_COLUMNS)}, "
+                          f"ROUND(-bm25(transactions_search, 0, 1, 1), 3) AS Score FROM {source} "
+                          f"ORDER BY Score DESC, t.Date DESC LIMIT ? OFFSET ?", params + [limit, offset])
+        return with_ledger_types(page), total
+
+    # Balance totals
+
+    def read_totals(self, username):
+        rows = self.connect().execute("SELECT Type, Paise, Count FROM totals WHERE Username = ?", (username,))
+        return {trans_type: {"paise": paise, "count": count} for trans_type, paise, count in rows}
+
+    def load_totals(self, username):
+        """Balance totals in rupees by transaction Type, maintained on every write."""
+        return totals_in_rupees(self.read_totals(username))
+
+    def rebuild_totals(self, username=None):
+        """Recomputes totals from the raw ledger, for one household or (username=None) everyone."""
+        conn = self.connect()
+        with conn:
+            if username is None:
+                conn.execute("DELETE FROM totals")
+                conn.execute(SQLITE_REBUILD_TOTALS.format(where=""))
+            else:
+                conn.execute("DELETE FROM totals WHERE Username = ?", (username,))
+                conn.execute(SQLITE_REBUILD_TOTALS.format(where="WHERE Username = ?"), (username,))
+        return None if username is None else self.read_totals(username)
+
+    def verify_totals(self, username):
+        """True if the stored totals match a recomputation from the raw ledger."""
+        return self.read_totals(username) == totals_from_ledger(self.load_transactions(username, columns=['Type', 'Amount']))
+
+    # Period rollups
+
+    def load_rollup(self, username, granularity):
+        """Amount and count per (Period, Type, Category) at "Daily", "Monthly" or "Yearly" granularity."""
+        rows = self.connect().execute("SELECT Period, Type, Category, Paise, Count FROM rollups WHERE Username = ? AND Granularity = ?",
+                                      (username, granularity)).fetchall()
+        return rollup_frame(rows, granularity)
+
+    def rebuild_rollups(self):
+        """Recomputes every household's rollups from the raw ledger."""
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM rollups")
+            for granularity, length in ROLLUP_PERIOD_LENGTH.items():
+                conn.execute("INSERT INTO rollups SELECT Username, ?, substr(Date, 1, ?), Type, COALESCE(Category, ''), "
+                             "SUM(CAST(ROUND(Amount * 100) AS INTEGER)), COUNT(*) FROM transactions GROUP BY 1, 3, 4, 5",
+                             (granularity, length))
+
+    # Categories
+
+    def load_categories(self, username):
+        """Loads custom categories for a user."""
+        return self.query("SELECT * FROM categories WHERE Username = ?", (username,), columns=CATEGORY_COLUMNS)
+
+    def save_category(self, username, category_type, category_name):
+        """Saves a custom category for a user. Returns False if the user already has it."""
+        conn = self.connect()
+        with conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO categories VALUES (?, ?, ?)", (username, category_type, category_name))
+            self.bump(conn, "categories", username)
+        return cursor.rowcount > 0
+
+    # Payment schedules
+
+    def load_schedules(self, username=None):
+        """Payment schedules of one household, or of every household."""
+        if username is None:
+            return schedule_frame(self.query(f"SELECT {', '.join(SCHEDULE_COLUMNS)} FROM schedules"))
+        return schedule_frame(self.query(f"SELECT {', '.join(SCHEDULE_COLUMNS)} FROM schedules WHERE Username = ?", (username,)))
+
+    def save_schedules(self, rows):
+        """Adds or replaces schedules (see schedule_rows)."""
+        conn = self.connect()
+        with conn:
+            conn.executemany(SQLITE_SAVE_SCHEDULE, rows[SCHEDULE_COLUMNS].astype(object).where(rows[SCHEDULE_COLUMNS].notna(), None).itertuples(index=False))
+            self.bump(conn, "schedules")
+        return rows
+
+    def delete_schedule(self, username, schedule_id):
+        """Deletes one of a household's schedules. Returns False if it has no such schedule."""
+        conn = self.connect()
+        with conn:
+            cursor = conn.execute("DELETE FROM schedules WHERE Id = ? AND Username = ?", (int(schedule_id), username))
+            self.bump(conn, "schedules")
+        return cursor.rowcount > 0
+
+    def post_due_schedules(self, until, usernames=None, schedule_ids=None):
+        """Records every payment due on or before `until` as a transaction and moves the schedules past them, in one
+        SQLite transaction. Covers the auto-posting schedules of every household (or of `usernames`), or the schedules
+        `schedule_ids` whatever their setting. Returns the transaction rows posted."""
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE") # No other process can post the same payments meanwhile
+            # Only the schedules covered are read (through the primary key or idx_schedules_user) while the write lock is held
+            clauses, params = [], []
+            if schedule_ids is not None:
+                clauses.append(f"Id IN ({','.join('?' * len(schedule_ids))})")
+                params.extend(int(schedule_id) for schedule_id in schedule_ids)
+            else:
+                clauses.append("AutoPost = 1")
+            if usernames is not None:
+                clauses.append(f"Username IN ({','.join('?' * len(usernames))})")
+                params.extend(usernames)
+            schedules = schedule_frame(pd.read_sql_query(f"SELECT {', '.join(SCHEDULE_COLUMNS)} FROM schedules WHERE {' AND '.join(clauses)}",
+                                                         conn, params=params))
+            records, paid = mykhata_schedules.payments_due(mykhata_schedules.DueQueue(due_schedules(schedules, usernames, schedule_ids)), until)
+            rows = transaction_rows(records)
+            if records:
+                self.insert_transactions(conn, rows)
+                conn.executemany("UPDATE schedules SET Paid = ? WHERE Id = ?", [(count, schedule_id) for schedule_id, count in paid.items()])
+                self.bump(conn, "schedules")
+        return rows
+
+
+# --- Shared Cache ---
+
+class CachedStorage:
+    """Process-wide, memory-bounded LRU cache of loaded frames in front of a storage engine.
+
+    Every session gets the same frame object for the same user, so frames returned by the
+    load_* methods must be treated as read-only. An entry is reused only while the engine's
+    version() for it is unchanged. Everything other than load_* is passed straight through.
+    """
+
+    def __init__(self, storage, max_bytes=CACHE_MAX_BYTES):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (version, frame, bytes), least recently used first
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def cached(self, key, version, load):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                METRICS.cache_event(hit=True)
+                return entry[1]
+            self.misses += 1
+        METRICS.cache_event(hit=False)
+        df = load()
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self.lock:
+            stale = self.entries.pop(key, None)
+            if stale is not None:
+                self.bytes -= stale[2]
+            if size <= self.max_bytes:
+                self.entries[key] = (version, df, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                    self.bytes -= evicted_size
+                    self.evictions += 1
+        return df
+
+    def load_users(self):
+        return self.cached(("users",), self.storage.version("users"), self.storage.load_users)
+
+    def load_transactions(self, username, columns=None, start=None, end=None):
+        """A household's ledger, or the part of it dated start..end, in its compact in-memory form (see compact_ledger)."""
+        window = tuple(None if value is None else date_text(value) for value in (start, end))
+        key = ("transactions", username, tuple(columns) if columns else None, window)
+        return self.cached(key, self.storage.version("transactions", username),
+                           lambda: compact_ledger(self.storage.load_transactions(username, columns, *window)))
+
+    def load_categories(self, username):
+        return self.cached(("categories", username), self.storage.version("categories", username),
+                           lambda: self.storage.load_categories(username))
+
+    def query_transactions(self, username, **filters):
+        """One page of transactions, from the cached ledger (only its start..end part if the filters have a date
+        range) unless the engine can page natively."""
+        if getattr(self.storage, "NATIVE_QUERIES", False):
+            return self.storage.query_transactions(username, **filters)
+        return query_frame(self.load_transactions(username, start=filters.get("start"), end=filters.get("end")), **filters)
+
+    def cache_stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+# --- Group Commit Writer ---
+
+class GroupCommitWriter:
+    """Serializes every write from every session through one background thread.
+
+    Callers block until their write is committed, so a returned write is durable. Transactions
+    that queue up while a commit is running are written together as one batch (one append and
+    fsync per household journal, or one SQLite transaction), so a burst of entries costs a
+    handful of commits instead of one per row.
+    """
+
+    def __init__(self, storage, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.storage = storage
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.commits = self.committed_rows = 0
+        threading.Thread(target=self.run, name="mykhata-writer", daemon=True).start()
+
+    def submit_async(self, method, *args):
+        """Queues storage.<method>(*args) and returns a Future for its result."""
+        future = Future()
+        self.queue.put((method, args, future))
+        return future
+
+    def submit(self, method, *args):
+        """Queues storage.<method>(*args) and waits for its result."""
+        return self.submit_async(method, *args).result()
+
+    def append_transaction(self, username, date, trans_type, category, amount, note, transaction_id=None):
+        return self.submit("append_transaction", username, date, trans_type, category, amount, note, transaction_id)
+
+    def update_transaction(self, username, transaction_id, date, trans_type, category, amount, note, old_date=None):
+        return self.submit("update_transaction", username, transaction_id, date, trans_type, category, amount, note, old_date)
+
+    def delete_transaction(self, username, transaction_id, old_date=None):
+        return self.submit("delete_transaction", username, transaction_id, old_date)
+
+    def save_category(self, username, category_type, category_name):
+        return self.submit("save_category", username, category_type, category_name)
+
+    def save_schedules(self, rows):
+        return self.submit("save_schedules", rows)
+
+    def delete_schedule(self, username, schedule_id):
+        return self.submit("delete_schedule", username, schedule_id)
+
+    def post_due_schedules(self, until, usernames=None, schedule_ids=None):
+        return self.submit("post_due_schedules", until, usernames, schedule_ids)
+
+    def add_user(self, user):
+        return self.submit("add_user", user)
+
+    def save_users(self, df):
+        return self.submit("save_users", df)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch):
+        # Runs of transaction appends are committed together; anything else runs on its own, in queue order
+        for is_append, ops in itertools.groupby(batch, key=lambda op: op[0] == "append_transaction"):
+            ops = list(ops)
+            if not is_append:
+                for method, args, future in ops:
+                    try:
+                        future.set_result(getattr(self.storage, method)(*args))
+                    except Exception as e:
+                        future.set_exception(e)
+                continue
+            try:
+                rows = self.storage.append_transactions(transaction_rows([args for _, args, _ in ops]))
+            except Exception as e:
+                for _, _, future in ops:
+                    future.set_exception(e)
+                continue
+            self.commits += 1
+            self.committed_rows += len(ops)
+            for i, (_, _, future) in enumerate(ops):
+                future.set_result(rows.iloc[[i]].reset_index(drop=True))
+
+
+# --- Backend Selection ---
+
+STORAGE_ENGINES = {"csv": CsvStorage, "parquet": ParquetStorage, "sqlite": SqliteStorage}
+
+def open_storage(engine=None, read_only=False):
+    """Opens the engine named by `engine` or the MYKHATA_STORAGE environment variable (default "csv").
+    With read_only=True the data is not migrated; the caller must have opened it normally first."""
+    engine = engine or os.environ.get("MYKHATA_STORAGE", "csv")
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine '{engine}'. Choose one of: {', '.join(STORAGE_ENGINES)}")
+    return STORAGE_ENGINES[engine](read_only=read_only)
+
+def migrate_csv_to_sqlite(source, target):
+    """Copies every user, transaction and category from a CsvStorage into a SqliteStorage."""
+    users = source.load_users()
+    target.save_users(users)
+
+    conn = target.connect()
+    transaction_count = 0
+    with conn:
+        for username in source.usernames():
+            df = source.load_transactions(username)[TRANSACTION_COLUMNS]
+            conn.executemany(SQLITE_INSERT_TRANSACTION,
+                             df.astype(object).where(df.notna(), None).itertuples(index=False))
+            transaction_count += len(df)
+
+        categories = pd.read_csv(source.category_file) if os.path.exists(source.category_file) else pd.DataFrame(columns=CATEGORY_COLUMNS)
+        conn.executemany("INSERT OR IGNORE INTO categories VALUES (?, ?, ?)", categories[CATEGORY_COLUMNS].itertuples(index=False))
+        schedules = source.load_schedules()
+        conn.executemany(SQLITE_SAVE_SCHEDULE, schedules.astype(object).where(schedules.notna(), None).itertuples(index=False))
+    target.rebuild_totals()
+    target.rebuild_rollups()
+    return {"users": len(users), "transactions": transaction_count, "categories": len(categories), "schedules": len(schedules)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MyKhata storage maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate-sqlite", help="Copy the CSV data files into a SQLite database")
+    migrate.add_argument("--db", default=SQLITE_FILE, help="SQLite database to create (default: %(default)s)")
+    verify = subcommands.add_parser("verify-totals", help="Check every household's balance totals against its raw ledger")
+    verify.add_argument("--rebuild", action="store_true", help="Recompute the totals of households that don't match")
+    post = subcommands.add_parser("post-due", help="Record the due payments of every household's auto-posting schedules")
+    post.add_argument("--date", help="post the payments due on or before this day, YYYY-MM-DD (default: today)")
+    post.add_argument("--dry-run", action="store_true", help="only list the payments that are due")
+    args = parser.parse_args()
+
+    if args.command == "migrate-sqlite":
+        if os.path.exists(args.db):
+            parser.error(f"{args.db} already exists; refusing to migrate into a non-empty database")
+        counts = migrate_csv_to_sqlite(CsvStorage(), SqliteStorage(args.db))
+        print(f"Migrated {counts['users']} users, {counts['transactions']} transactions, {counts['categories']} categories "
+              f"and {counts['schedules']} payment schedules into {args.db}")
+
+    elif args.command == "verify-totals":
+        storage = open_storage()
+        mismatched = [username for username in storage.usernames() if not storage.verify_totals(username)]
+        for username in mismatched:
+            print(f"{username}: totals do not match the ledger" + (" (rebuilt)" if args.rebuild else ""))
+            if args.rebuild:
+                storage.rebuild_totals(username)
+        print(f"{len(mismatched)} household(s) with mismatched totals")
+        sys.exit(1 if mismatched and not args.rebuild else 0)
+
+    elif args.command == "post-due":
+        storage = open_storage()
+        until = pd.Timestamp(args.date or "today").date()
+        if args.dry_run:
+            due_queue = mykhata_schedules.DueQueue(due_schedules(storage.load_schedules()))
+            print(mykhata_schedules.reminders(due_queue, until, days=0).to_string(index=False))
+        else:
+            rows = storage.post_due_schedules(until)
+            print(f"Posted {len(rows)} payment(s) for {rows['Username'].nunique()} household(s)")